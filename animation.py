@@ -0,0 +1,183 @@
+import numpy as np
+
+from direct.showbase.ShowBaseGlobal import globalClock
+from panda3d.core import ConfigVariableDouble
+
+from instancing import SphereInstance
+
+
+animation_time_scale = ConfigVariableDouble(
+    'animation-time-scale', 1.0,
+    'Multiplies the duration of every sphere animation; 0 applies the result of a click in the same frame.')
+
+
+class Tween:
+
+    WAIT = 0    # no model; only keeps its group from finishing
+    POS = 1
+    SCALE = 2   # uniform scale in the first value
+
+
+class Animator:
+    """All the running tweens of sphere models, held in flat arrays and advanced
+       by one task per frame. Tweens belong to groups, and the callback of a group
+       is called in the frame its last tween finishes.
+    """
+
+    def __init__(self, capacity=64, time_scale=None):
+        """time_scale: multiplies the durations and delays of the tweens; animation-time-scale by default
+        """
+        self.time_scale = animation_time_scale.getValue() if time_scale is None else time_scale
+        self.models = []
+        self.kinds = np.zeros(capacity, dtype=np.int8)
+        self.groups = np.zeros(capacity, dtype=np.int64)
+        self.start_values = np.zeros((capacity, 3), dtype=np.float32)
+        self.end_values = np.zeros((capacity, 3), dtype=np.float32)
+        self.start_times = np.zeros(capacity, dtype=np.float64)
+        self.durations = np.zeros(capacity, dtype=np.float64)
+
+        self.pending = {}    # group: the number of its tweens not finished
+        self.callbacks = {}  # group: function called when the group finishes
+        self.next_group = 1
+
+    def __len__(self):
+        return len(self.models)
+
+    def start(self):
+        base.taskMgr.add(self.update, 'animate', sort=-1)
+
+    def _grow(self, count):
+        if count <= len(self.kinds):
+            return
+        capacity = max(count, len(self.kinds) * 2)
+        for name in ('kinds', 'groups', 'start_values', 'end_values', 'start_times', 'durations'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def group(self, callback=None):
+        group = self.next_group
+        self.next_group += 1
+        self.pending[group] = 0
+        if callback:
+            self.callbacks[group] = callback
+        return group
+
+    def add(self, models, kind, starts, ends, duration, delay=0, group=None):
+        """Add one tween for each of models, all in one group.
+           starts, ends: the values of each tween, or the values shared by all of them
+        """
+        if group is None:
+            group = self.group()
+        if not (count := len(models)):
+            return group
+
+        i = len(self.models)
+        self._grow(i + count)
+        self.models.extend(models)
+        self.kinds[i:i + count] = kind
+        self.groups[i:i + count] = group
+        self.start_values[i:i + count] = starts
+        self.end_values[i:i + count] = ends
+        self.start_times[i:i + count] = globalClock.getFrameTime() + delay * self.time_scale
+        self.durations[i:i + count] = duration * self.time_scale
+        self.pending[group] += count
+        return group
+
+    def move(self, models, starts, ends, duration, delay=0, group=None):
+        return self.add(models, Tween.POS, starts, ends, duration, delay, group)
+
+    def scale(self, models, start, end, duration, delay=0, group=None):
+        return self.add(models, Tween.SCALE, (start, 0, 0), (end, 0, 0), duration, delay, group)
+
+    def wait(self, duration, callback=None, group=None):
+        if group is None:
+            group = self.group(callback)
+        return self.add([None], Tween.WAIT, 0, 0, duration, 0, group)
+
+    def update(self, task):
+        self.step(globalClock.getFrameTime())
+        return task.cont
+
+    def step(self, now):
+        if not (n := len(self.models)):
+            return
+
+        t = (now - self.start_times[:n]) / np.maximum(self.durations[:n], 1e-9)
+        started = t >= 0
+        finished = t >= 1
+        t = np.clip(t, 0, 1)[:, np.newaxis]
+        values = self.start_values[:n] + (self.end_values[:n] - self.start_values[:n]) * t
+
+        self._write(np.flatnonzero(started & (self.kinds[:n] == Tween.POS)), values, Tween.POS)
+        self._write(np.flatnonzero(started & (self.kinds[:n] == Tween.SCALE)), values, Tween.SCALE)
+
+        if finished.any():
+            self._finish(finished)
+
+    def _write(self, indices, values, kind):
+        if not len(indices):
+            return
+
+        models = [self.models[i] for i in indices]
+        if isinstance(models[0], SphereInstance):
+            # instances of one SphereInstances are written into its buffer at once.
+            instances = models[0].instances
+            if kind == Tween.POS:
+                instances.set_positions(models, values[indices])
+            else:
+                instances.set_scales(models, values[indices, 0])
+            return
+
+        if kind == Tween.POS:
+            for model, (x, y, z) in zip(models, values[indices].tolist()):
+                model.setPos(x, y, z)
+        else:
+            for model, s in zip(models, values[indices, 0].tolist()):
+                model.setScale(s)
+
+    def _finish(self, finished):
+        n = len(self.models)
+        keep = ~finished
+        groups, counts = np.unique(self.groups[:n][finished], return_counts=True)
+
+        self.models = [m for m, k in zip(self.models, keep.tolist()) if k]
+        count = len(self.models)
+        for name in ('kinds', 'groups', 'start_values', 'end_values', 'start_times', 'durations'):
+            array = getattr(self, name)
+            array[:count] = array[:n][keep]
+
+        done = []
+        for group, count in zip(groups.tolist(), counts.tolist()):
+            self.pending[group] -= count
+            if not self.pending[group]:
+                del self.pending[group]
+                if callback := self.callbacks.pop(group, None):
+                    done.append(callback)
+
+        # callbacks may start new tweens, so they are called after the arrays are compacted.
+        for callback in done:
+            callback()
+
+    def finish(self):
+        """Jump all the tweens to their end, calling the callbacks of their groups,
+           and of the groups those callbacks start.
+        """
+        while self.models:
+            self.start_times[:len(self.models)] = -np.inf
+            self.step(0)
+
+    def flush(self):
+        """Finish the tweens at once if the time scale is 0, so that their callbacks run
+           in the frame which started them instead of the next one.
+        """
+        if not self.time_scale:
+            self.finish()
+
+    def clear(self):
+        """Drop all the tweens without calling any callback.
+        """
+        self.models = []
+        self.pending.clear()
+        self.callbacks.clear()
@@ -0,0 +1,201 @@
+"""Load each model and texture once, and keep baked copies of them for the next start.
+
+    python assets.py              # bake the assets into the cache directory
+    python assets.py --startup    # report the start times with no, a cold and a warm cache
+
+Models are baked into .bam files and textures into .txo files under the directory
+set by `asset-cache` in Config.prc. A baked file older than its source is baked again.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from panda3d.core import ConfigVariableString, Filename, NodePath, TexturePool
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODEL_EXTENSIONS = ('.bam', '.egg', '.egg.pz')
+
+asset_cache = ConfigVariableString(
+    'asset-cache', 'cache',
+    'Directory of the baked models and textures, relative to the game directory; '
+    'empty to load the sources at every start.')
+
+
+class Assets:
+    """Models and textures by path. Models are shared, so they must be copied or instanced
+       before being changed or reparented.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.textures = {}
+        self.baked = 0
+
+    def clear(self):
+        self.models.clear()
+        self.textures.clear()
+
+    def _source(self, path, extensions=('',)):
+        for ext in extensions:
+            if os.path.exists(file := os.path.join(ROOT, path + ext)):
+                return file
+        raise FileNotFoundError(f'no asset found for {path}')
+
+    def _baked(self, source, ext):
+        """Return the path of the baked file of source, or None if baking is disabled,
+           and whether the baked file is up to date.
+        """
+        if not (cache := asset_cache.getValue()):
+            return None, False
+
+        baked = os.path.join(ROOT, cache, os.path.relpath(source, ROOT) + ext)
+        fresh = os.path.exists(baked) and os.path.getmtime(baked) >= os.path.getmtime(source)
+        return baked, fresh
+
+    def model(self, path):
+        if (model := self.models.get(path)) is None:
+            source = self._source(path, MODEL_EXTENSIONS)
+            baked, fresh = self._baked(source, '.bam')
+
+            if fresh:
+                model = base.loader.loadModel(Filename.fromOsSpecific(baked), noCache=True)
+            else:
+                model = base.loader.loadModel(Filename.fromOsSpecific(source), noCache=True)
+                if baked:
+                    os.makedirs(os.path.dirname(baked), exist_ok=True)
+                    model.writeBamFile(Filename.fromOsSpecific(baked))
+                    self.baked += 1
+            self.models[path] = model
+
+        return model
+
+    def copy_model(self, path, parent=None):
+        """Return a copy of the model, which can be changed freely.
+        """
+        return self.model(path).copyTo(parent if parent is not None else NodePath())
+
+    def instance_model(self, path, parent):
+        """Return an instance of the model under parent, sharing its nodes with the other instances.
+        """
+        return self.model(path).instanceTo(parent)
+
+    def texture(self, path):
+        if (tex := self.textures.get(path)) is None:
+            source = self._source(path)
+            baked, fresh = self._baked(source, '.txo')
+
+            if fresh:
+                tex = TexturePool.loadTexture(Filename.fromOsSpecific(baked))
+            else:
+                tex = base.loader.loadTexture(Filename.fromOsSpecific(source))
+                if baked:
+                    os.makedirs(os.path.dirname(baked), exist_ok=True)
+                    tex.write(Filename.fromOsSpecific(baked))
+                    self.baked += 1
+            self.textures[path] = tex
+
+        return tex
+
+
+assets = Assets()
+
+
+def bake():
+    """Load every asset of the game, baking the ones which are missing or out of date.
+    """
+    from cubic_same_game import PATH_SPHERE
+    import scene
+
+    for path in (PATH_SPHERE, scene.PATH_SPACE, scene.PATH_PLANETS):
+        assets.model(path)
+    for path in (scene.PATH_SPACE_TEXTURE, scene.PATH_EARTH_TEXTURE, scene.PATH_MOON_TEXTURE,
+                 scene.PATH_SATELLITE_TEXTURE, scene.PATH_SUN_TEXTURE):
+        assets.texture(path)
+
+
+def first_frame(started, sync):
+    """Start the game offscreen, and print the seconds from started to the first frame
+       and to the backdrop being complete.
+    """
+    from panda3d.core import loadPrcFileData
+    loadPrcFileData('startup', 'window-type offscreen\naudio-library-name null\nsync-video false\n'
+                               f'async-startup {"false" if sync else "true"}')
+    from cubic_same_game import Game
+    # this file runs as __main__, so the game loads through the assets of the imported module.
+    from assets import assets as loaded
+
+    game = Game()
+    game.taskMgr.step()
+    first = time.time() - started
+    while not game.scene.complete:
+        game.taskMgr.step()
+    print(loaded.baked, first, time.time() - started, flush=True)
+
+
+def time_startup(cache, sync=False):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--first-frame', '--cache', cache,
+         '--started', str(time.time())] + (['--sync'] if sync else []),
+        cwd=ROOT, capture_output=True, text=True
+    )
+    # the exit status is not checked, as only the start matters.
+    if not result.stdout.strip():
+        raise RuntimeError(f'the game did not start:\n{result.stderr}')
+    baked, first, backdrop = result.stdout.split()[-3:]
+    return int(baked), float(first), float(backdrop)
+
+
+def report_startup(repeat):
+    cache = tempfile.mkdtemp(prefix='cubic_same_game_assets')
+    cases = [
+        ('no cache', '', False, repeat),
+        ('cold cache', cache, False, 1),
+        ('warm cache', cache, False, repeat),
+        ('warm, sync', cache, True, repeat),
+    ]
+    print(f"{'case':<12}{'first frame ms':>16}{'backdrop ms':>14}{'baked':>7}")
+
+    try:
+        for name, path, sync, n in cases:
+            runs = [time_startup(path, sync) for _ in range(n)]
+            first = statistics.median(r[1] for r in runs)
+            backdrop = statistics.median(r[2] for r in runs)
+            print(f'{name:<12}{first * 1000:>16.0f}{backdrop * 1000:>14.0f}{runs[0][0]:>7}')
+    finally:
+        shutil.rmtree(cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bake the CubicSameGame assets.')
+    parser.add_argument('--startup', action='store_true',
+                        help='report the times to the first frame and to the complete backdrop '
+                             'with no, a cold and a warm cache')
+    parser.add_argument('--repeat', type=int, default=3, help='starts measured for each case')
+    parser.add_argument('--cache', help='use this cache directory instead of the configured one')
+    parser.add_argument('--first-frame', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--started', type=float, help=argparse.SUPPRESS)
+    parser.add_argument('--sync', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cache is not None:
+        asset_cache.setValue(args.cache)
+
+    if args.first_frame:
+        first_frame(args.started, args.sync)
+    elif args.startup:
+        report_startup(args.repeat)
+    else:
+        from direct.showbase.ShowBase import ShowBase
+        ShowBase(windowType='none')
+        bake()
+        print(f'{assets.baked} assets baked into {os.path.join(ROOT, asset_cache.getValue())}')
+
+
+if __name__ == '__main__':
+    main()
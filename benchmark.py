@@ -0,0 +1,443 @@
+"""Benchmarks for the game logic and the scene hot paths.
+
+    python benchmark.py                    # run and compare with benchmark_baseline.json
+    python benchmark.py --save-baseline    # store the results as the new baseline
+    python benchmark.py --logic-only --sizes 3 4 8 16
+    python benchmark.py --soak 1000 --sizes 6    # restart 1000 times, checking time and memory stay flat
+    python benchmark.py --check-settle 5000      # check Board.settle against the scan it replaced
+
+The scene cases render into an offscreen buffer, so no window is opened.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from board import Board, CONNECTED
+
+
+PATH_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+BENCHMARKS = []
+
+
+def benchmark(name, scene=False):
+    """Register a benchmark. The decorated function takes the cube size
+       (and the Game for scene benchmarks) and returns (setup, run):
+       setup() prepares a fresh state which is passed to run(), and only run is timed.
+       A case returns None for the sizes it does not run at.
+    """
+    def decorator(func):
+        BENCHMARKS.append((name, scene, func))
+        return func
+    return decorator
+
+
+def random_board(size, seed, cleared=0.0, rule=None):
+    rng = np.random.default_rng(seed)
+    board = Board.random(size, rng=rng, **({'rule': rule} if rule else {}))
+    board.cells[rng.random(board.cells.shape) < cleared] = 0
+    return board
+
+
+@benchmark('logic.find_same_colors')
+def find_same_colors(size):
+    board = random_board(size, 1)
+    cells = [board.get_components(t) for t in range(0, size ** 3, max(1, size ** 3 // 64))]
+
+    def run(_):
+        for x, y, z in cells:
+            board.find_same_colors(x, y, z)
+
+    return (lambda: None), run
+
+
+@benchmark('logic.can_continue')
+def can_continue(size):
+    board = random_board(size, 2, cleared=0.5)
+    board.settle()
+    return (lambda: None), (lambda _: board.can_continue())
+
+
+@benchmark('logic.settle')
+def settle(size):
+    board = random_board(size, 3)
+    rng = np.random.default_rng(3)
+
+    def setup():
+        b = board.copy()
+        b.cells[rng.random(b.cells.shape) < 0.3] = 0
+        return b
+
+    return setup, (lambda b: b.settle())
+
+
+@benchmark('logic.play')
+def play(size):
+    def setup():
+        board = random_board(size, 4)
+        return board, int(np.flatnonzero(board.deletable_mask())[0])
+
+    return setup, (lambda args: args[0].play(args[1]))
+
+
+@benchmark('logic.play_connected')
+def play_connected(size):
+    # the component index is built once, and play only updates it around the deletion.
+    board = random_board(size, 4, rule=CONNECTED)
+    board.can_continue()
+
+    def setup():
+        b = board.copy()
+        return b, int(b.group_sizes().argmax())
+
+    return setup, (lambda args: (args[0].play(args[1]), args[0].can_continue()))
+
+
+@benchmark('logic.continue_connected')
+def can_continue_connected(size):
+    board = random_board(size, 2, cleared=0.5, rule=CONNECTED)
+    board.settle()
+    board.can_continue()
+    return (lambda: None), (lambda _: board.can_continue())
+
+
+@benchmark('logic.grade_board')
+def grade_board(size):
+    from generator import grade
+    # grading plays whole games, so only the sizes the game offers are measured.
+    if size > 6:
+        return None
+    seeds = iter(range(10 ** 6))
+    return (lambda: next(seeds)), (lambda seed: grade(size, seed))
+
+
+def clear_spheres(game):
+    game.store.remove_all()
+
+
+def new_game(game, size):
+    game.animator.clear()
+    clear_spheres(game)
+    game._initialize(size)
+
+
+@benchmark('scene.setup_spheres', scene=True)
+def setup_spheres(size, game):
+    game.size = size
+    game.new_board(1)
+    return (lambda: clear_spheres(game)), (lambda _: game.setup_spheres())
+
+
+@benchmark('scene.restart', scene=True)
+def restart(size, game):
+    new_game(game, size)
+    return (lambda: None), (lambda _: new_game(game, size))
+
+
+@benchmark('scene.move', scene=True)
+def move(size, game):
+    rng = np.random.default_rng(5)
+
+    def setup():
+        new_game(game, size)
+        tags = np.flatnonzero(rng.random(size ** 3) < 0.3).tolist()
+        game.store.remove(tags)
+        game.board.delete(tags)
+
+    return setup, (lambda _: game.move())
+
+
+@benchmark('scene.delete', scene=True)
+def delete(size, game):
+    def setup():
+        new_game(game, size)
+        return int(game.board.group_sizes().argmax())
+
+    return setup, (lambda tag: game.delete(tag))
+
+
+@benchmark('scene.animate', scene=True)
+def animate(size, game):
+    from direct.showbase.ShowBaseGlobal import globalClock
+    setup_move, _ = move(size, game)
+
+    def setup():
+        # one frame of the spheres falling after a third of them were deleted.
+        setup_move()
+        game.move()
+        return globalClock.getFrameTime() + 0.1
+
+    return setup, (lambda now: game.animator.step(now))
+
+
+@benchmark('scene.backdrop', scene=True)
+def backdrop(size, game):
+    from direct.showbase.ShowBaseGlobal import globalClock
+    # one frame of every backdrop body moving, the sun included; the size does not matter.
+    game.scene.sun.rotate_around()
+    orbits = game.scene.orbits
+    return (lambda: None), (lambda _: orbits.step(globalClock.getFrameTime()))
+
+
+@benchmark('scene.click_instant', scene=True)
+def click_instant(size, game):
+    # a whole click, from the deletion to the last settle wave, with animation-time-scale 0.
+    setup_delete, _ = delete(size, game)
+
+    def run(tag):
+        scale, game.animator.time_scale = game.animator.time_scale, 0
+        try:
+            game.delete(tag)
+        finally:
+            game.animator.time_scale = scale
+
+    return setup_delete, run
+
+
+def rotating(game, size):
+    from cubic_same_game import Arrow, Status
+    from direct.showbase.InputStateGlobal import inputState
+
+    new_game(game, size)
+    game.status = Status.PLAY
+    inputState.set(Arrow.UP.key, True, 'benchmark')
+
+
+@benchmark('scene.update_rotating', scene=True)
+def update_rotating(size, game):
+    rotating(game, size)
+    task = game.taskMgr.getTasksNamed('update')[0]
+    return (lambda: None), (lambda _: game.update(task))
+
+
+@benchmark('scene.frame_rotating', scene=True)
+def frame_rotating(size, game):
+    rotating(game, size)
+    return (lambda: None), (lambda _: game.taskMgr.step())
+
+
+@benchmark('scene.pick_lattice', scene=True)
+def pick_lattice(size, game):
+    from panda3d.core import Point2
+    new_game(game, size)
+    return (lambda: None), (lambda _: game.pick_lattice(Point2(0.01, 0.02)))
+
+
+@benchmark('scene.pick_collision', scene=True)
+def pick_collision(size, game):
+    from panda3d.core import Point2
+    new_game(game, size)
+    return (lambda: None), (lambda _: game.pick_collision(Point2(0.01, 0.02)))
+
+
+def measure(setup, run, min_time=0.2, min_repeat=3, max_repeat=1000):
+    # the first run may pay for loading models or preparing the scene.
+    run(setup())
+    times = []
+    total = 0
+
+    while len(times) < min_repeat or (total < min_time and len(times) < max_repeat):
+        arg = setup()
+        start = time.perf_counter()
+        run(arg)
+        elapsed = time.perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+
+    # memory is measured on a separate run, because tracing slows down the timed ones.
+    arg = setup()
+    tracemalloc.start()
+    run(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'median_ms': statistics.median(times) * 1000,
+        'min_ms': min(times) * 1000,
+        'runs': len(times),
+        'peak_kib': peak / 1024,
+    }
+
+
+def create_game():
+    from panda3d.core import loadPrcFileData
+    loadPrcFileData('benchmark', 'window-type offscreen\naudio-library-name null\nsync-video false\n'
+                                 'async-startup false\nrender-quality high\nidle-fps 0\nboard-pool')
+    from cubic_same_game import Game
+    return Game()
+
+
+def run(sizes, pattern=None, logic_only=False):
+    game = None
+    results = {}
+
+    for name, scene, func in BENCHMARKS:
+        if (pattern and pattern not in name) or (scene and logic_only):
+            continue
+        if scene and game is None:
+            game = create_game()
+
+        for size in sizes:
+            if (case := func(size, game) if scene else func(size)) is None:
+                continue
+            setup, timed = case
+            results.setdefault(name, {})[str(size)] = result = measure(setup, timed)
+            print(f"{name:<26}{size:>4}{result['median_ms']:>12.3f} ms{result['peak_kib']:>12.1f} KiB",
+                  file=sys.stderr)
+
+    return results
+
+
+def soak(restarts, size, threshold):
+    """Restart a game restarts times and report the restart time, the traced memory
+       and the number of nodes every tenth of the way. Return True if the memory or
+       the time at the end is more than threshold times the one after the first tenth.
+    """
+    game = create_game()
+    every = max(1, restarts // 10)
+    times, rows = [], []
+    tracemalloc.start()
+    print(f"{'restarts':>9}{'median ms':>12}{'max ms':>10}{'memory KiB':>12}{'nodes':>8}{'pooled':>8}")
+
+    for i in range(1, restarts + 1):
+        start = time.perf_counter()
+        new_game(game, size)
+        times.append(time.perf_counter() - start)
+        game.taskMgr.step()
+
+        if i % every == 0:
+            current, _ = tracemalloc.get_traced_memory()
+            rows.append((statistics.median(times) * 1000, current / 1024))
+            print(f'{i:>9}{rows[-1][0]:>12.3f}{max(times) * 1000:>10.3f}{rows[-1][1]:>12.1f}'
+                  f'{game.render.countNumDescendants():>8}{len(game.sphere_root.pool):>8}')
+            times.clear()
+
+    tracemalloc.stop()
+    (first_ms, first_kib), (last_ms, last_kib) = rows[0], rows[-1]
+    print(f'time x{last_ms / first_ms:.2f}, memory x{last_kib / first_kib:.2f} from the first tenth to the last')
+    return last_ms > first_ms * threshold or last_kib > first_kib * threshold
+
+
+def reference_settle(cells):
+    """Settle cells as the game did before Board.settle: scan the cells in tag order,
+       move the first sphere which has an empty neighbor closer to the center one cell,
+       and scan again from the start until no sphere moves.
+    """
+    size = cells.shape[0]
+    coords = np.arange(size) * 2 - (size - 1)
+    distance = lambda cell: sum(float(coords[i]) ** 2 for i in cell) ** 0.5
+    board = Board(cells)
+    moved = True
+
+    while moved:
+        moved = False
+        for cell in np.ndindex(cells.shape):
+            if not cells[cell]:
+                continue
+            if empty := [nb for nb in board.get_neighbors(*cell) if not cells[nb]]:
+                nearest = min(empty, key=distance)
+                if distance(nearest) < distance(cell):
+                    cells[nearest], cells[cell] = cells[cell], 0
+                    moved = True
+                    break
+    return cells
+
+
+def check_settle(count, seed=0):
+    """Settle count random boards of sizes 2 to 6 with some cells cleared, both by Board.settle
+       and by reference_settle, and return the number of boards whose results differ.
+    """
+    rng = np.random.default_rng(seed)
+    mismatches = 0
+
+    for _ in range(count):
+        board = Board.random(int(rng.integers(2, 7)), rng=rng)
+        board.cells[rng.random(board.cells.shape) < rng.random() * 0.5] = 0
+        expected = reference_settle(board.cells.copy())
+        board.settle()
+        if not np.array_equal(board.cells, expected):
+            mismatches += 1
+
+    print(f'{count - mismatches} of {count} settles matched the reference')
+    return mismatches
+
+
+def compare(results, baseline, threshold):
+    regressions = 0
+    print(f"{'case':<26}{'size':>5}{'median ms':>12}{'baseline':>12}{'ratio':>8}{'peak KiB':>12}")
+
+    for name, sizes in results.items():
+        for size, result in sizes.items():
+            line = f"{name:<26}{size:>5}{result['median_ms']:>12.3f}"
+            if base := baseline.get(name, {}).get(size):
+                ratio = result['median_ms'] / base['median_ms']
+                line += f"{base['median_ms']:>12.3f}{ratio:>8.2f}"
+                if ratio > threshold:
+                    line += '  REGRESSION'
+                    regressions += 1
+            else:
+                line += f"{'-':>12}{'-':>8}"
+            print(line + f"{result['peak_kib']:>12.1f}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CubicSameGame hot paths.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[3, 4, 6, 8, 12, 16])
+    parser.add_argument('--filter', help='run only the cases whose name contains this string')
+    parser.add_argument('--logic-only', action='store_true', help='skip the cases which need a scene')
+    parser.add_argument('--baseline', default=PATH_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='report a regression when a case is this many times slower than the baseline')
+    parser.add_argument('--output', help='also write the results to this json file')
+    parser.add_argument('--soak', type=int, metavar='RESTARTS',
+                        help='instead of the cases, restart a game of the first size this many times '
+                             'and report whether the time or the memory grows')
+    parser.add_argument('--check-settle', type=int, metavar='BOARDS',
+                        help='instead of the cases, check Board.settle against the scan it replaced '
+                             'on this many random boards')
+    args = parser.parse_args()
+
+    if args.check_settle:
+        if check_settle(args.check_settle):
+            sys.exit(1)
+        return
+
+    if args.soak:
+        if soak(args.soak, args.sizes[0], args.threshold):
+            sys.exit(1)
+        return
+
+    results = run(args.sizes, args.filter, args.logic_only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        return
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.threshold)
+    for size, result in results.get('logic.grade_board', {}).items():
+        print(f"board generation at size {size}: {1000 / result['median_ms']:.1f} boards/s per core")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
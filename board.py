@@ -0,0 +1,365 @@
+import functools
+import heapq
+
+import numpy as np
+
+
+EMPTY = 0
+
+# the number of colors the game can draw spheres in.
+MAX_COLORS = 10
+
+# how the spheres deleted by a click are found.
+LINES = 'lines'           # the ones of the same color lined up with the clicked sphere along the axes
+CONNECTED = 'connected'   # the ones of the same color connected to the clicked sphere through faces
+RULES = (LINES, CONNECTED)
+
+# the six face neighbors: +x, -x, +y, -y, +z, -z
+DIRECTIONS = ((1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1))
+
+
+@functools.lru_cache(maxsize=None)
+def lattice(size):
+    """Return the distance rank of each cell from the center of the cube
+       and the tags of its six neighbors (-1 outside the cube), both indexed by tag.
+       Cells at the same distance from the center share a rank.
+    """
+    coords = np.arange(size) * 2 - (size - 1)
+    x, y, z = np.meshgrid(coords, coords, coords, indexing='ij')
+    _, ranks = np.unique((x ** 2 + y ** 2 + z ** 2).ravel(), return_inverse=True)
+
+    tags = np.arange(size ** 3).reshape((size,) * 3)
+    neighbors = np.full((size ** 3, len(DIRECTIONS)), -1, dtype=np.intp)
+
+    for i, direction in enumerate(DIRECTIONS):
+        axis = next(a for a, d in enumerate(direction) if d)
+        lo = [slice(None)] * 3
+        hi = [slice(None)] * 3
+        lo[axis] = slice(None, -1)
+        hi[axis] = slice(1, None)
+        src, dest = (lo, hi) if direction[axis] > 0 else (hi, lo)
+        neighbors[tags[tuple(src)].ravel(), i] = tags[tuple(dest)].ravel()
+
+    ranks = ranks.reshape(-1)
+    ranks.flags.writeable = False
+    neighbors.flags.writeable = False
+    return ranks, neighbors
+
+
+class Components:
+    """The groups of spheres of the same color connected through faces, labeled by cell.
+       The labels are kept up to date by relabeling only the groups around the cells
+       which change, so that the size of a group and whether any group can be deleted
+       are looked up without scanning the cube.
+    """
+
+    def __init__(self, cells, size):
+        """cells: the flattened cells of the board, shared with it
+        """
+        self.cells = cells
+        self.size = size
+        self.labels = np.full(len(cells), -1, dtype=np.int64)   # -1 for the empty cells
+        self.sizes = {}      # label: the number of its spheres
+        self.roots = {}      # label: the tag of one of its spheres
+        self.playable = 0    # the number of groups of two or more spheres
+        self.next_label = 0
+        self.update(np.flatnonzero(cells).tolist())
+
+    def copy(self, cells):
+        components = Components.__new__(Components)
+        components.cells = cells
+        components.size = self.size
+        components.labels = self.labels.copy()
+        components.sizes = self.sizes.copy()
+        components.roots = self.roots.copy()
+        components.playable = self.playable
+        components.next_label = self.next_label
+        return components
+
+    def group_size(self, tag):
+        if (label := self.labels[tag]) < 0:
+            return 0
+        return self.sizes[label]
+
+    def groups(self):
+        """Return the tag of one sphere and the size of every group of two or more spheres.
+        """
+        return [(self.roots[label], size) for label, size in self.sizes.items() if size > 1]
+
+    def group_sizes(self):
+        sizes = np.zeros(len(self.cells), dtype=np.int64)
+        occupied = self.labels >= 0
+        lookup = np.zeros(self.next_label, dtype=np.int64)
+        lookup[list(self.sizes)] = list(self.sizes.values())
+        sizes[occupied] = lookup[self.labels[occupied]]
+        sizes[sizes < 2] = 0
+        return sizes
+
+    def flood(self, tag):
+        """Return the tags of the group containing the sphere at tag, from the cells.
+        """
+        _, neighbors = lattice(self.size)
+        cells = self.cells
+        color = cells[tag]
+        found = {tag}
+        work = [tag]
+
+        while work:
+            for nb in neighbors[work.pop()].tolist():
+                if nb >= 0 and nb not in found and cells[nb] == color:
+                    found.add(nb)
+                    work.append(nb)
+        return found
+
+    def update(self, changed):
+        """Relabel the groups which contained or now contain any of the changed tags or their neighbors.
+        """
+        _, neighbors = lattice(self.size)
+        changed = np.asarray(changed, dtype=np.intp)
+        seeds = np.unique(np.concatenate([changed, neighbors[changed].ravel()]))
+        seeds = seeds[seeds >= 0]
+
+        # every piece a changed cell split off a group touches it, so it is among the seeds.
+        for label in np.unique(self.labels[seeds]).tolist():
+            if label >= 0:
+                if self.sizes.pop(label) > 1:
+                    self.playable -= 1
+                del self.roots[label]
+
+        self.labels[seeds] = -1
+        for tag in seeds.tolist():
+            if self.cells[tag] and self.labels[tag] < 0:
+                group = list(self.flood(tag))
+                label = self.next_label
+                self.next_label += 1
+                self.labels[group] = label
+                self.sizes[label] = len(group)
+                self.roots[label] = tag
+                if len(group) > 1:
+                    self.playable += 1
+
+
+class Board:
+    """The cube as an array of color indices; 0 means the cell is empty.
+       A cell's tag is its index in the flattened array, so that
+       tag = x * size ** 2 + y * size + z.
+    """
+
+    def __init__(self, cells, rule=LINES):
+        """rule: LINES or CONNECTED, how the spheres deleted by a click are found
+        """
+        if rule not in RULES:
+            raise ValueError(f"rule must be one of {', '.join(RULES)}, not {rule}")
+        self.cells = np.ascontiguousarray(cells, dtype=np.uint8)
+        self.size = self.cells.shape[0]
+        self.rule = rule
+        self._components = None
+
+    @classmethod
+    def random(cls, size, n_colors=None, rng=None, rule=LINES):
+        """By default a cube of size n is filled with n colors, or MAX_COLORS if n is larger.
+        """
+        n_colors = n_colors or min(size, MAX_COLORS)
+        rng = rng if rng is not None else np.random.default_rng()
+        return cls(rng.integers(1, n_colors + 1, size=(size,) * 3, dtype=np.uint8), rule)
+
+    def copy(self):
+        board = Board(self.cells.copy(), self.rule)
+        if self._components is not None:
+            board._components = self._components.copy(board.cells.reshape(-1))
+        return board
+
+    @property
+    def components(self):
+        """The index of the connected groups, built at the first use
+           and updated by delete and settle after that.
+        """
+        if self._components is None:
+            self._components = Components(self.cells.reshape(-1), self.size)
+        return self._components
+
+    def get_components(self, tag):
+        return tuple(int(i) for i in np.unravel_index(tag, self.cells.shape))
+
+    def get_tag(self, x, y, z):
+        return (x * self.size + y) * self.size + z
+
+    def remaining(self):
+        return int(np.count_nonzero(self.cells))
+
+    def get_neighbors(self, x, y, z):
+        for dx, dy, dz in DIRECTIONS:
+            nx, ny, nz = x + dx, y + dy, z + dz
+            if 0 <= nx < self.size and 0 <= ny < self.size and 0 <= nz < self.size:
+                yield nx, ny, nz
+
+    def is_deletable(self, x, y, z):
+        if not (color := self.cells[x, y, z]):
+            return False
+        return any(self.cells[n] == color for n in self.get_neighbors(x, y, z))
+
+    def deletable_mask(self):
+        """Return a boolean array which is True for every occupied cell
+           having at least one neighbor of the same color.
+        """
+        cells = self.cells
+        mask = np.zeros(cells.shape, dtype=bool)
+
+        for axis in range(3):
+            lo = [slice(None)] * 3
+            hi = [slice(None)] * 3
+            lo[axis] = slice(None, -1)
+            hi[axis] = slice(1, None)
+            same = (cells[tuple(lo)] == cells[tuple(hi)]) & (cells[tuple(lo)] != EMPTY)
+            mask[tuple(lo)] |= same
+            mask[tuple(hi)] |= same
+
+        return mask
+
+    def enclosed(self, tags):
+        """Return, for each of tags, whether its cell and all of its six neighbors are occupied.
+           The spheres do not fill the cells, so a sphere there can still be seen through the gaps.
+        """
+        _, neighbors = lattice(self.size)
+        # the extra last element is looked up by the -1 of the neighbors outside the cube.
+        occupied = np.append(self.cells.reshape(-1) != EMPTY, False)
+        return occupied[tags] & occupied[neighbors[tags]].all(axis=1)
+
+    def run_lengths(self, axis):
+        """Return, for every cell, the length of the run of cells of its color
+           along the axis that contains it.
+        """
+        moved = np.moveaxis(self.cells, axis, -1)
+        lines = moved.reshape(-1, self.size)
+        starts = np.ones(lines.shape, dtype=bool)
+        starts[:, 1:] = lines[:, 1:] != lines[:, :-1]
+        labels = np.cumsum(starts.ravel()) - 1
+        lengths = np.bincount(labels)[labels].reshape(lines.shape)
+        return np.moveaxis(lengths.reshape(moved.shape), -1, axis)
+
+    def group_sizes(self):
+        """Return, for every cell, the number of spheres find_same_colors
+           would delete if the cell were clicked; 0 for cells which are not deletable.
+        """
+        if self.rule == CONNECTED:
+            return self.components.group_sizes().reshape(self.cells.shape)
+
+        sizes = sum(self.run_lengths(axis) - 1 for axis in range(3)) + 1
+        return np.where(self.deletable_mask(), sizes, 0)
+
+    def group_size(self, tag):
+        """Return the number of spheres a click on tag would delete.
+        """
+        if self.rule == CONNECTED:
+            return size if (size := self.components.group_size(tag)) > 1 else 0
+        return len(self.find_same_colors(*self.get_components(tag)))
+
+    def can_continue(self):
+        if self.rule == CONNECTED:
+            return self.components.playable > 0
+        return bool(self.deletable_mask().any())
+
+    def _run(self, line, i):
+        """Return the start and stop of the run of True in line containing i.
+        """
+        before = line[i::-1]
+        after = line[i:]
+        start = i - (len(before) if before.all() else int(before.argmin())) + 1
+        stop = i + (len(after) if after.all() else int(after.argmin()))
+        return start, stop
+
+    def find_same_colors(self, x, y, z):
+        """Return the tags of the clicked sphere and the spheres of the same color
+           lined up with it along the x, y and z axes, or connected to it with the CONNECTED rule.
+        """
+        if not self.is_deletable(x, y, z):
+            return []
+
+        if self.rule == CONNECTED:
+            return sorted(self.components.flood(self.get_tag(x, y, z)))
+
+        color = self.cells[x, y, z]
+        tags = {self.get_tag(x, y, z)}
+        idx = np.arange(self.size)
+
+        start, stop = self._run(self.cells[:, y, z] == color, x)
+        tags.update(self.get_tag(i, y, z) for i in idx[start:stop])
+        start, stop = self._run(self.cells[x, :, z] == color, y)
+        tags.update(self.get_tag(x, i, z) for i in idx[start:stop])
+        start, stop = self._run(self.cells[x, y, :] == color, z)
+        tags.update(self.get_tag(x, y, i) for i in idx[start:stop])
+
+        return sorted(int(t) for t in tags)
+
+    def delete(self, tags):
+        self.cells.reshape(-1)[tags] = EMPTY
+        if self._components is not None and len(tags):
+            self._components.update(tags)
+
+    def unsettled_mask(self):
+        """Return a boolean array, indexed by tag, which is True for every sphere
+           having an empty neighbor closer to the center than itself.
+        """
+        ranks, neighbors = lattice(self.size)
+        flat = self.cells.reshape(-1)
+        valid = neighbors >= 0
+        nb = np.where(valid, neighbors, 0)
+        closer = valid & (flat[nb] == EMPTY) & (ranks[nb] < ranks[:, None])
+        return (flat != EMPTY) & closer.any(axis=1)
+
+    def settle(self):
+        """Move the spheres toward the center of the cube one cell at a time, always moving
+           the sphere of the lowest tag which has an empty neighbor closer to the center,
+           until none has. Return the moves as a list of (from tag, to tag) pairs, one per
+           sphere that moved.
+        """
+        ranks, neighbors = (a.tolist() for a in lattice(self.size))
+        flat = self.cells.reshape(-1)
+        cells = flat.tolist()
+        origins = {}
+
+        def closest_empty(tag):
+            found, rank = None, ranks[tag]
+            for nb in neighbors[tag]:
+                if nb >= 0 and not cells[nb] and ranks[nb] < rank:
+                    found, rank = nb, ranks[nb]
+            return found
+
+        # every sphere which can move is in the heap; the ones which no longer can are dropped when popped.
+        work = np.flatnonzero(self.unsettled_mask()).tolist()
+
+        while work:
+            src = heapq.heappop(work)
+            if not cells[src] or (dest := closest_empty(src)) is None:
+                continue
+
+            while dest is not None:
+                cells[dest], cells[src] = cells[src], EMPTY
+                origins[dest] = origins.pop(src, src)
+
+                # the spheres farther out than the vacated cell may fall into it.
+                for nb in neighbors[src]:
+                    if nb >= 0 and cells[nb] and ranks[nb] > ranks[src]:
+                        heapq.heappush(work, nb)
+
+                # the moved sphere goes on at once while no sphere of a lower tag can move.
+                src = dest
+                if work and work[0] < src:
+                    heapq.heappush(work, src)
+                    break
+                dest = closest_empty(src)
+
+        flat[:] = cells
+        moves = sorted((src, dest) for dest, src in origins.items())
+        if self._components is not None and moves:
+            self._components.update(np.array(moves).ravel())
+        return moves
+
+    def play(self, tag):
+        """Delete the group of the sphere at tag and let the rest settle,
+           as a click does in the game. Return the tags of the deleted spheres.
+        """
+        if tags := self.find_same_colors(*self.get_components(tag)):
+            self.delete(tags)
+            self.settle()
+        return tags
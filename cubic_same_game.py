@@ -1,25 +1,81 @@
-import itertools
-import random
+import atexit
 import sys
 from enum import Enum, auto
 
 from direct.gui.DirectGui import OnscreenText, ScreenTitle
 from direct.gui.DirectGui import DirectOptionMenu, DirectLabel, DirectButton
-from direct.interval.IntervalGlobal import Sequence, Parallel, Func, Wait
 from direct.showbase.InputStateGlobal import inputState
 from direct.showbase.ShowBaseGlobal import globalClock
 from direct.showbase.ShowBase import ShowBase
+import numpy as np
 from panda3d.core import TextNode, PandaNode, NodePath
-from panda3d.core import Quat, Vec3, LColor, BitMask32, Point3
+from panda3d.core import ConfigVariableBool, ConfigVariableInt, ConfigVariableString
+from panda3d.core import Quat, Vec3, Point2, Point3, LColor, BitMask32
 from panda3d.core import CollisionTraverser, CollisionNode
 from panda3d.core import CollisionHandlerQueue, CollisionRay
 
+from animation import Animator
+from board import RULES, lattice
+from generator import BoardPool, board_difficulty, generate
+from idle import IdleScheduler
+from instancing import SphereInstances, SPHERE_RADIUS
 from lights import BasicDayLight, BasicAmbientLight
+from picking import pick_cell
+from profiler import profiler, ProfilerOverlay
+from quality import Quality, sphere_model, set_geoms
+from replay import Recorder, Event, arrows_to_mask
+from savefile import SavedGame, save, load
 from scene import Scene
+from server import Client
+from solver import Solver
 from window import Window
 
 
 PATH_SPHERE = 'models/sphere/sphere'
+SPHERE_SCALE = 0.2
+SHAKE_TIME = 0.1
+DISAPPEAR_TIME = 0.3
+MOVE_TIME = 0.2
+HINT_TIME = 0.015
+NOTICE_TIME = 3
+PATH_SAVE = 'cubic_same_game.sav'
+PATH_TRACE = 'cubic_same_game.trace.json'
+
+instanced_spheres = ConfigVariableBool(
+    'instanced-spheres', False,
+    'Draw all the spheres from one shared geometry with hardware instancing.')
+lattice_picking = ConfigVariableBool(
+    'lattice-picking', True,
+    'Pick the clicked sphere by walking the cube lattice instead of traversing collision solids.')
+check_picking = ConfigVariableBool(
+    'check-picking', False,
+    'Pick the clicked sphere both ways and report when the results differ.')
+board_seed = ConfigVariableInt(
+    'board-seed', -1,
+    'Seed of the first board, to reproduce it; a negative value gives a random board.')
+record_input = ConfigVariableString(
+    'record-input', '',
+    'Record the clicks and rotations of the session into this file, to be replayed by replay.py.')
+profile_frames = ConfigVariableBool(
+    'profile-frames', False,
+    'Measure the game loop from the start, without showing the profiler overlay.')
+hide_occluded = ConfigVariableBool(
+    'hide-occluded', False,
+    'Stash the spheres whose six neighbors are all occupied; they can be seen through the gaps, '
+    'so this trades holes in the cube for speed on large cubes.')
+match_rule = ConfigVariableString(
+    'match-rule', RULES[0],
+    'lines deletes the spheres of the clicked color lined up with it; connected, the ones connected to it.')
+hover_preview = ConfigVariableBool(
+    'hover-preview', True,
+    'Show how many spheres a click would delete while the mouse is over a sphere.')
+game_server = ConfigVariableString(
+    'game-server', '',
+    'Play each game as a session of server.py at host:port or at the path of its Unix socket too, '
+    'reporting when its results differ.')
+async_startup = ConfigVariableBool(
+    'async-startup', True,
+    'Show the cube first and load the backdrop in the background, instead of loading all before the first frame.')
 
 
 class Arrow(Enum):
@@ -61,8 +117,9 @@ class Colors(Enum):
     SKY = LColor(0, 0.74, 1, 1)
 
     @classmethod
-    def select(cls, n):
-        return random.sample([m.value for m in cls], n)
+    def get(cls, indices):
+        members = list(cls)
+        return [members[i].value for i in indices]
 
 
 class SphereRoot(NodePath):
@@ -70,78 +127,291 @@ class SphereRoot(NodePath):
     def __init__(self):
         super().__init__(PandaNode('sphereRoot'))
         self.reparentTo(base.render)
+        self.template = None
+        self.detail = 'high'
+        self.pool = []   # detached sphere models, reused by create_sphere
 
-    def create_sphere(self, point, tag, color, pos):
+    def rotate_around(self, angle, axis):
+        """Rotate the whole cube around the world axis passing through its center.
+           The spheres keep their positions relative to this node.
+        """
+        q = Quat()
+        q.setFromAxisAngle(angle, axis.normalized())
+        self.setQuat(self.getQuat() * q)
+
+    def _template(self):
+        # copying a loaded model is much faster than asking the loader for each sphere.
+        if self.template is None:
+            self.template = sphere_model(PATH_SPHERE, self.detail)
+            self.template.setScale(SPHERE_SCALE)
+            self.template.find('**/Sphere').node().setIntoCollideMask(BitMask32.bit(1))
+        return self.template
+
+    def reserve(self, count):
+        """Make count spheres available for a cube, creating or dropping pooled ones
+           only if the live and pooled spheres together are not count already.
+        """
+        live = self.getNumChildren() + self.getStashedChildren().getNumPaths()
+        if (extra := live + len(self.pool) - count) > 0:
+            for model in self.pool[len(self.pool) - extra:]:
+                model.removeNode()
+            del self.pool[len(self.pool) - extra:]
+        elif extra < 0:
+            template = self._template()
+            self.pool.extend(template.copyTo(NodePath()) for _ in range(-extra))
+
+    def release(self, models):
+        """Take back the models of deleted spheres, to be reused by create_sphere.
+        """
+        for model in models:
+            model.detachNode()
+        self.pool.extend(models)
+
+    def set_detail(self, detail):
+        """Switch the geometry of the template and of every sphere, including the stashed and pooled ones.
+        """
+        if detail == self.detail:
+            return
+
+        self.detail = detail
+        self.template = None
+        source = sphere_model(PATH_SPHERE, detail).find('**/+GeomNode').node()
+        for root in [self] + self.pool:
+            for sphere in root.findAllMatches('**/Sphere;+s'):
+                set_geoms(sphere.node(), source)
+
+    def create_sphere(self, tag, color, pos):
         """color: LColor
            pos: Vec3
         """
-        model = base.loader.loadModel(PATH_SPHERE)
-        model.reparentTo(self)
-        model.setScale(0.2)
+        if self.pool:
+            model = self.pool.pop()
+            model.reparentTo(self)
+            model.setScale(SPHERE_SCALE)
+        else:
+            model = self._template().copyTo(self)
+
         model.setColor(color)
         model.setPos(pos)
-
-        model.find('**/Sphere').node().setIntoCollideMask(BitMask32.bit(1))
-        model.find('**/Sphere').node().setTag('sphere', str(tag))
+        model.getChild(0).node().setTag('sphere', str(tag))
         # render/sphereRoot/sphere.egg/Sphere
 
-        return Sphere(model, point, tag)
+        return model
+
+
+class InstancedSphereRoot(SphereRoot):
+
+    def __init__(self):
+        super().__init__()
+        self.instances = None
+
+    def reserve(self, count):
+        # the slots of released instances are reused as long as the count stays.
+        if self.instances and self.instances.count == count:
+            return
+        if self.instances:
+            self.instances.removeNode()
+        self.instances = SphereInstances(sphere_model(PATH_SPHERE, self.detail), count)
+        self.instances.reparentTo(self)
+        self.pool = []
+
+    def release(self, models):
+        for model in models:
+            model.release()
+        self.pool.extend(models)
+
+    def set_detail(self, detail):
+        if detail == self.detail:
+            return
+
+        self.detail = detail
+        if self.instances:
+            self.instances.set_model(sphere_model(PATH_SPHERE, detail))
+
+    def create_sphere(self, tag, color, pos):
+        """color: LColor
+           pos: Vec3
+        """
+        if self.pool:
+            return self.pool.pop().reuse(tag, color, pos, SPHERE_SCALE)
+        return self.instances.create_instance(tag, color, pos, SPHERE_SCALE)
+
+
+class SphereStore:
+    """The sphere models of the cube in arrays indexed by the cell tag, as the board cells are.
+    """
+
+    def __init__(self, size, hide_occluded=True, release=None):
+        """release: function taking back the models removed, instead of removing them from the scene graph
+        """
+        self.size = size
+        self.hide_occluded = hide_occluded
+        self.release = release
+        start = size // 2 * -2 + 1 if size % 2 == 0 else size // 2 * -2
+        # (x, y, z) of each tag, spaced 2 apart around the center: [-3, -1, 1, 3] if size is 4
+        coords = np.indices((size,) * 3).reshape(3, -1).T
+        self.positions = (start + coords * 2).astype(np.float32)
+        self.models = np.full(size ** 3, None, dtype=object)
+        self.colors = np.zeros(size ** 3, dtype=np.uint8)   # as the board cells: 0 if no model
+        self.alive = np.zeros(size ** 3, dtype=bool)
+        self.hidden = np.zeros(size ** 3, dtype=bool)
+        self.touched = None   # the tags exposed since the last hide; None for all
+
+    def pos(self, tag):
+        return Vec3(*self.positions[tag].tolist())
+
+    def set(self, tag, model, color):
+        self.models[tag] = model
+        self.colors[tag] = color
+        self.alive[tag] = True
+
+    def remove(self, tags):
+        """Remove the models of tags from the scene graph.
+        """
+        if self.release:
+            self.release(self.models[tags].tolist())
+        else:
+            for model in self.models[tags]:
+                model.removeNode()
+        self.models[tags] = None
+        self.colors[tags] = 0
+        self.alive[tags] = False
+        self.hidden[tags] = False
+
+    def remove_all(self):
+        self.remove(np.flatnonzero(self.alive))
+
+    def transfer(self, sources, destinations):
+        """Hand the models of sources over to destinations, and return them.
+        """
+        models, colors = self.models[sources], self.colors[sources]
+        # a sphere may move into a cell emptied by another one moving in the same settle,
+        # so it can still be hidden.
+        for model in models[self.hidden[sources]]:
+            model.unstash()
+        self.hidden[sources] = False
+        self.models[sources] = None
+        self.colors[sources] = 0
+        self.alive[sources] = False
+        self.models[destinations] = models
+        self.colors[destinations] = colors
+        self.alive[destinations] = True
+        self.hidden[destinations] = False
+        return models
+
+    def _around(self, tags):
+        _, neighbors = lattice(self.size)
+        around = np.unique(np.concatenate([np.asarray(tags, dtype=np.intp), neighbors[tags].ravel()]))
+        around = around[around >= 0]
+        return around[self.alive[around]]
+
+    def expose(self, board, tags):
+        """Unstash the models next to tags, whose cells have just been emptied on board.
+           They are checked again by the next hide_occluded.
+        """
+        if not self.hide_occluded:
+            return
+
+        around = self._around(tags)
+        show = around[self.hidden[around] & ~board.enclosed(around)]
+        for model in self.models[show]:
+            model.unstash()
+        self.hidden[show] = False
+
+        if self.touched is not None:
+            self.touched.append(around)
+
+    def hide(self, board):
+        """Stash the models which board encloses, among the ones exposed since the last call,
+           or among all of them at the first call.
+        """
+        if not self.hide_occluded:
+            return
+
+        if self.touched is None:
+            tags = np.flatnonzero(self.alive)
+        elif self.touched:
+            tags = np.unique(np.concatenate(self.touched))
+            tags = tags[self.alive[tags]]
+        else:
+            return
+
+        stash = tags[~self.hidden[tags] & board.enclosed(tags)]
+        for model in self.models[stash]:
+            model.stash()
+        self.hidden[stash] = True
+        self.touched = []
 
 
 class Sphere:
+    """View of one cell of a SphereStore.
+    """
+
+    __slots__ = ('store', 'tag')
 
-    def __init__(self, model, point, tag):
-        self.model = model
-        self.color = self.model.getColor()
-        self.pos = self.model.getPos()   # LPoint3
+    def __init__(self, store, tag):
+        self.store = store
         self.tag = tag
-        self.point = point
-        self.destination = False
 
     @property
-    def distance(self):
-        return (self.pos.x ** 2 + self.pos.y ** 2 + self.pos.z ** 2) ** 0.5
+    def model(self):
+        return self.store.models[self.tag]
 
-    def rotate_around(self, angle, axis):
-        q = Quat()
-        q.setFromAxisAngle(angle, axis.normalized())
-        r = q.xform(self.pos - self.point)
-        self.pos = self.point + r
+    @property
+    def pos(self):
+        """Vec3, relative to sphereRoot
+        """
+        return self.store.pos(self.tag)
 
-        if self.model:
-            self.model.setPos(self.pos)
+    def shake(self, animator, group=None):
+        # shake vertically on the screen, whichever way the cube is rotated.
+        model, pos = self.model, self.pos
+        offset = model.getParent().getRelativeVector(base.render, Vec3(0, 0, 0.2))
+        points = [pos, pos + offset, pos - offset, pos]
+
+        for i, (start, end) in enumerate(zip(points, points[1:])):
+            group = animator.move([model], start, end, SHAKE_TIME, i * SHAKE_TIME, group)
+        return group
 
-    def shake(self):
-        return Sequence(
-            self.model.posInterval(0.1, self.pos + (0, 0, 0.2)),
-            self.model.posInterval(0.1, self.pos - (0, 0, 0.2)),
-            self.model.posInterval(0.1, self.pos),
-        )
 
-    def _delete(self):
-        self.model.removeNode()
-        self.model = None
-        self.color = None
+class Preview(OnscreenText):
 
-    def disappear(self):
-        return Sequence(
-            self.model.scaleInterval(0.3, 0.01),
-            Func(self._delete)
+    def __init__(self):
+        super().__init__(
+            parent=base.a2dBottomRight,
+            fg=(1, 1, 1, 1),
+            pos=(-0.1, 0.18),
+            align=TextNode.ARight,
+            scale=0.05,
+            mayChange=True
         )
+        self.size = 0
+
+    def display(self, size):
+        if size != self.size:
+            self.size = size
+            self.setText(f'Click to delete {size}' if size else '')
+
+
+class Notice(OnscreenText):
 
-    def set_destination(self, cell):
-        self.destination = False
-        cell.destination = True
-        cell.model = self.model
-        cell.color = self.color
-        self.model, self.color = None, None
-
-    def move_model(self):
-        return Sequence(
-            self.model.posInterval(0.2, self.pos),
-            Func(lambda: self.model.find('**/Sphere').node().setTag('sphere', str(self.tag)))
+    def __init__(self):
+        super().__init__(
+            parent=base.a2dBottomRight,
+            fg=(1, 1, 0.6, 1),
+            pos=(-0.1, 0.26),
+            align=TextNode.ARight,
+            scale=0.05,
+            mayChange=True
         )
 
+    def show(self, text, duration=NOTICE_TIME):
+        """Show text for duration seconds.
+        """
+        self.setText(text)
+        base.taskMgr.remove('clearNotice')
+        base.taskMgr.doMethodLater(duration, lambda task: self.setText(''), 'clearNotice')
+
 
 class ScoreBoard(OnscreenText):
 
@@ -165,6 +435,11 @@ class ScoreBoard(OnscreenText):
         self.total += self.score
         self.setText(self.display_text.format(self.score, self.total))
 
+    def restore(self, total):
+        self.score = 0
+        self.total = total
+        self.setText(self.display_text.format(self.score, self.total))
+
 
 class Game(ShowBase):
 
@@ -176,23 +451,94 @@ class Game(ShowBase):
         self.camera.setHpr(0, -90, 0)
         self.camera.lookAt(0, 0, 0)
         self.scene = Scene()
+        self.loading_text = None
+        self.day_light = None
         self.status = Status.PLAY
-        self.sphere_moving = None
+        self.animator = Animator()
         self.scoreboard = ScoreBoard()
+        self.preview = Preview()
+        self.notice = Notice()
+        self.hovered = None
         self.gameover_gui = GameoverScreen(self.restart_game)
         self.size = 4
+        self.solver = Solver()
+        self.board_pool = BoardPool()
+        self.profiler_overlay = ProfilerOverlay(self.profile_counters)
+        profiler.enabled = profile_frames.getValue()
 
         BasicAmbientLight()
-        BasicDayLight()
 
         self.setup_instructions()
         self.setup_controls()
         self.setup_collision_detection()
 
-        self.sphere_root = SphereRoot()
+        self.sphere_root = self.create_sphere_root()
+        self.quality = Quality(self)
+        self.quality.start()
+        self.new_board(seed if (seed := board_seed.getValue()) >= 0 else None)
         self.setup_spheres()
 
+        self.session_recorder = None
+        if path := record_input.getValue():
+            self.session_recorder = Recorder(path)
+            atexit.register(self.session_recorder.close)
+            self.session_recorder.board(self.saved_game())
+
+        self.server = None
+        if address := game_server.getValue():
+            try:
+                self.server = Client(address)
+            except (OSError, RuntimeError, ValueError) as e:
+                self.notice.show(f'Could not connect to the game server: {e}')
+            else:
+                atexit.register(self.server.close)
+                self.call_server(self.server.reset, self.saved_game())
+
         self.taskMgr.add(self.update, 'update')
+        self.animator.start()
+        self.idle = IdleScheduler(self, self.busy)
+
+        if async_startup:
+            self.taskMgr.add(self.load_backdrop, 'loadBackdrop')
+        else:
+            self.day_light = BasicDayLight()
+            self.quality.apply()
+            self.scene.load(threaded=False)
+
+    def load_backdrop(self, task):
+        # the cube is playable from the first frame; the shadows and the backdrop follow it.
+        if task.frame == 0:
+            return task.cont
+
+        self.day_light = BasicDayLight()
+        self.quality.apply()
+        self.loading_text = OnscreenText(
+            text=f'Loading the backdrop 0/{len(self.scene.stages)}',
+            parent=self.a2dBottomLeft,
+            fg=(1, 1, 1, 1),
+            pos=(0.06, 0.06),
+            align=TextNode.ALeft,
+            scale=0.04,
+            mayChange=True
+        )
+        self.scene.load(self.show_progress)
+        return task.done
+
+    def show_progress(self, stage, done, total):
+        if done < total:
+            self.loading_text.setText(f'Loading the backdrop {done}/{total}: {stage} ready')
+        else:
+            self.loading_text.destroy()
+            self.loading_text = None
+
+    def create_sphere_root(self):
+        if instanced_spheres:
+            gsg = self.win.getGsg()
+            if gsg.getSupportsGeometryInstancing() and gsg.getSupportsBufferTexture() \
+                    and gsg.getSupportsBasicShaders():
+                return InstancedSphereRoot()
+            print('instanced-spheres is not supported by the graphics device; draw spheres one by one.')
+        return SphereRoot()
 
     def setup_instructions(self):
         instructions = OnscreenText(
@@ -206,6 +552,9 @@ class Game(ShowBase):
         instructions.appendText('Esc: Quit\r\n')
         instructions.appendText('Left-click: Select to delete\r\n')
         instructions.appendText('Arrows: Rotate\r\n')
+        instructions.appendText('h: Hint\r\n')
+        instructions.appendText('F5: Save  F9: Load\r\n')
+        instructions.appendText('F3: Profiler  F4: Export trace\r\n')
 
     def setup_collision_detection(self):
         self.picker = CollisionTraverser()
@@ -220,169 +569,319 @@ class Game(ShowBase):
 
     def setup_controls(self):
         self.accept('mouse1', self.click)
+        self.accept('h', self.hint)
+        self.accept('f5', self.save_game)
+        self.accept('f9', self.load_game)
+        self.accept('f3', self.profiler_overlay.toggle)
+        self.accept('f4', self.export_trace)
         self.accept("escape", sys.exit)
 
         for name, key in Arrow.keys():
             inputState.watchWithModifiers(name, key)
 
+    def new_board(self, seed=None):
+        """Take a graded board from the pool, or draw one from seed if it is given or the pool is empty.
+        """
+        rule = match_rule.getValue()
+        if seed is not None or not (saved := self.board_pool.take(self.size, rule, board_difficulty.getValue())):
+            saved = generate(self.size, seed, rule)
+        self.board = saved.board
+        self.palette = list(saved.palette)
+
     def setup_spheres(self):
-        start = self.size // 2 * -2 + 1 if self.size % 2 == 0 else self.size // 2 * -2
-        pts = [start + i * 2 for i in range(self.size)]
-        # pts = [-3, -1, 1, 3]
-        point = Point3(0, 0, 0)
-        self.colors = Colors.select(self.size)
-        self.spheres = [[[None for _ in range(self.size)] for _ in range(self.size)] for _ in range(self.size)]
-        upper = self.size - 1
-
-        for i, (x, y, z) in enumerate(itertools.product(range(self.size), repeat=3)):
-            pos = Vec3(pts[x], pts[y], pts[z])
-            idx = random.randint(0, upper)
-            sphere = self.sphere_root.create_sphere(point, i, self.colors[idx], pos)
-            self.spheres[x][y][z] = sphere
+        """Create the spheres of self.board; the cells which are empty get no model.
+        """
+        # the running tweens belong to the spheres being replaced.
+        self.animator.clear()
+        self.sphere_root.setQuat(Quat.identQuat())
+        self.sphere_root.reserve(self.size ** 3)
+        self.colors = Colors.get(self.palette)
+        self.store = SphereStore(self.size, hide_occluded.getValue(), self.sphere_root.release)
+        cells = self.board.cells.reshape(-1)
+
+        for tag in np.flatnonzero(cells).tolist():
+            color = int(cells[tag])
+            model = self.sphere_root.create_sphere(tag, self.colors[color - 1], self.store.pos(tag))
+            self.store.set(tag, model, color)
+        self.store.hide(self.board)
+
+    def saved_game(self):
+        return SavedGame(self.board.copy(), tuple(self.palette), self.scoreboard.total)
+
+    def save_game(self, path=PATH_SAVE):
+        if self.status == Status.PLAY:
+            try:
+                save(path, self.saved_game())
+            except OSError as e:
+                self.notice.show(f'Could not save the game: {e.strerror}')
+            else:
+                self.notice.show('Saved')
+
+    def load_game(self, path=PATH_SAVE):
+        if self.status == Status.PLAY:
+            try:
+                saved = load(path)
+            except FileNotFoundError:
+                self.notice.show('No saved game yet: F5 saves one')
+                return
+            except (OSError, ValueError) as e:
+                self.notice.show(f'Could not load the saved game: {e}')
+                return
+
+            self.restore(saved)
+            if self.session_recorder:
+                self.session_recorder.board(self.saved_game())
+            if self.server:
+                self.call_server(self.server.reset, self.saved_game())
+
+    def restore(self, saved):
+        self.store.remove_all()
+        board, palette, total = saved
+        self.size = board.size
+        # a saved game is played by the rule it was saved with.
+        self.board = board.copy()
+        self.palette = list(palette)
+        self.scoreboard.restore(total)
+        self.setup_spheres()
 
     def click(self):
         if self.mouseWatcherNode.hasMouse() and self.status == Status.PLAY:
             pos = self.mouseWatcherNode.getMouse()
-            self.picker_ray.setFromLens(self.camNode, pos.getX(), pos.getY())
-            self.picker.traverse(self.sphere_root)
-
-            if self.handler.getNumEntries() > 0:
-                self.handler.sortEntries()
-                tag = int(self.handler.getEntry(0).getIntoNode().getTag('sphere'))
-                # print([s.getIntoNode().getTag('sphere') for s in self.handler.getEntries()])
-                # print(tag)
-                self.delete(tag)
 
-    def get_components(self, tag):
-        x = tag // self.size ** 2
-        y = (tag // self.size) % self.size
-        z = tag % self.size
-        return x, y, z
+            with profiler.section('pick'):
+                if lattice_picking:
+                    tag = self.pick_lattice(pos)
+                    if check_picking and (found := self.pick_collision(pos)) != tag:
+                        print(f'lattice picking found {tag}, but collision picking found {found}.')
+                else:
+                    tag = self.pick_collision(pos)
+
+            if tag is not None:
+                self.delete(tag)
 
+    def hint(self):
+        """Shake the sphere to click next, searching for at most HINT_TIME seconds.
+        """
+        if self.status == Status.PLAY:
+            first = np.flatnonzero(~self.store.hidden).tolist() if self.store.hide_occluded else None
+            if moves := self.solver.solve(self.board, HINT_TIME, first=first).moves:
+                self.get_sphere(moves[0]).shake(self.animator)
+
+    def pick_collision(self, mouse_pos):
+        self.picker_ray.setFromLens(self.camNode, mouse_pos.getX(), mouse_pos.getY())
+        self.picker.traverse(self.sphere_root)
+
+        if self.handler.getNumEntries() > 0:
+            self.handler.sortEntries()
+            return int(self.handler.getEntry(0).getIntoNode().getTag('sphere'))
+        return None
+
+    def pick_lattice(self, mouse_pos):
+        near, far = Point3(), Point3()
+        if not self.camLens.extrude(mouse_pos, near, far):
+            return None
+
+        origin = self.sphere_root.getRelativePoint(self.cam, near)
+        direction = self.sphere_root.getRelativePoint(self.cam, far) - origin
+        radius = SPHERE_RADIUS * SPHERE_SCALE
+
+        # the stashed spheres are not drawn, so the ray passes them as collision picking does.
+        hidden = self.store.hidden.reshape(self.board.cells.shape) if self.store.hide_occluded else None
+        if cell := pick_cell(self.board.cells, origin, direction, radius, skip=hidden):
+            return self.board.get_tag(*cell)
+        return None
+
+    def get_sphere(self, tag):
+        return Sphere(self.store, tag)
+
+    @profiler.trace('delete')
     def delete(self, tag):
-        x, y, z = self.get_components(tag)
-        self.delete_seq = Sequence(self.spheres[x][y][z].shake())
+        if self.session_recorder:
+            self.session_recorder.click(tag)
+
+        x, y, z = self.board.get_components(tag)
         self.status = Status.CLICKED
 
-        if same_spheres := [s.disappear() for s in self.find_same_colors(x, y, z)]:
-            if len(same_spheres) >= 4:
-                self.scene.sun.rotate_around()
-            disappear = Parallel(*same_spheres)
-            self.scoreboard.display(len(disappear))
-            self.delete_seq.append(disappear)
-            self.status = Status.DELETE
+        with profiler.section('find_same_colors'):
+            tags = self.board.find_same_colors(x, y, z)
 
-        self.delete_seq.start()
+        if not tags:
+            if self.server:
+                self.check_server(tag, 0)
+            self.get_sphere(tag).shake(self.animator, self.animator.group(self.clicked))
+            self.animator.flush()
+            return
 
-    def update(self, task):
-        dt = globalClock.getDt()
-        self.scene.moon.sattelite.rotate_around(dt)
+        self.board.delete(tags)
+        self.store.expose(self.board, tags)
+        if len(tags) >= 4 and self.scene.sun:
+            self.scene.sun.rotate_around()
+        self.scoreboard.display(len(tags))
+        if self.server:
+            self.check_server(tag, len(tags))
+        self.status = Status.DELETE
+
+        group = self.animator.group(lambda: self.deleted(tags))
+        self.get_sphere(tag).shake(self.animator, group)
+        self.disappear(tags, group, SHAKE_TIME * 3)
+        self.animator.flush()
+
+    def check_server(self, tag, deleted):
+        """Click tag in the session on the game server, and report if it deleted or scored differently.
+        """
+        if (result := self.call_server(self.server.click, tag)) is None:
+            return
+        if result.score != deleted or result.total != self.scoreboard.total:
+            self.notice.show(f'The game server deleted {result.score} spheres for a total of {result.total}, '
+                             f'but the game deleted {deleted} for a total of {self.scoreboard.total}')
 
-        if self.status == Status.PLAY:
-            velocity = 0
-            axis = Vec3.forward()
-
-            if inputState.isSet(Arrow.UP.key):
-                velocity += 10
-            elif inputState.isSet(Arrow.DOWN.key):
-                velocity -= 10
-            elif inputState.isSet(Arrow.LEFT.key):
-                velocity += 10
-                axis = Vec3.up()
-            elif inputState.isSet(Arrow.RIGHT.key):
-                velocity -= 10
-                axis = Vec3.up()
-
-            if rotation_angle := velocity * dt:
-                for x, y, z in itertools.product(range(self.size), repeat=3):
-                    sphere = self.spheres[x][y][z]
-                    sphere.rotate_around(rotation_angle, axis)
-
-        if self.status == Status.CLICKED:
-            if not self.delete_seq.isPlaying():
-                self.status = Status.PLAY
-        elif self.status == Status.DELETE:
-            if not self.delete_seq.isPlaying():
-                self.status = Status.MOVE
-        elif self.status == Status.MOVE:
-            if not self.sphere_moving:
-                if not self.move():
-                    if self.can_continue():
-                        self.status = Status.PLAY
-                    else:
-                        self.status = Status.GAMEOVER
-                        self.show_gameover_screen()
-            else:
-                if not self.sphere_moving.isPlaying():
-                    self.sphere_moving = None
-        elif self.status == Status.RESTART:
-            if not self.gameover_seq.isPlaying():
-                self.status = Status.PLAY
+    def call_server(self, request, *args):
+        """Return the reply of a request to the game server. If the request fails,
+           the failure is shown and the game goes on without the server.
+        """
+        try:
+            return request(*args)
+        except (OSError, RuntimeError) as e:
+            self.notice.show(f'Stopped playing on the game server: {e}')
+            self.server.close()
+            self.server = None
+            return None
+
+    def disappear(self, tags, group, delay=0):
+        """Shrink the models of tags, which are removed by the callback of the group.
+        """
+        models = self.store.models[tags].tolist()
+        self.animator.scale(models, SPHERE_SCALE, 0.01, DISAPPEAR_TIME, delay, group)
 
-        return task.cont
+    def clicked(self):
+        self.status = Status.PLAY
 
-    def _find(self, x, y, z, color, dx=0, dy=0, dz=0):
-        x, y, z = x + dx, y + dy, z + dz
-        if not ((0 <= x < self.size) and (0 <= y < self.size) and (0 <= z < self.size)):
-            return
-        if self.spheres[x][y][z].color != color:
-            return
+    def deleted(self, tags):
+        self.store.remove(tags)
 
-        yield self.spheres[x][y][z]
-        yield from self._find(x, y, z, color, dx, dy, dz)
-
-    def find_same_colors(self, x, y, z):
-        if self.is_deletable(x, y, z):
-            sphere = self.spheres[x][y][z]
-            yield sphere
-            yield from self._find(x, y, z, sphere.color, dx=1)
-            yield from self._find(x, y, z, sphere.color, dx=-1)
-            yield from self._find(x, y, z, sphere.color, dy=1)
-            yield from self._find(x, y, z, sphere.color, dy=-1)
-            yield from self._find(x, y, z, sphere.color, dz=1)
-            yield from self._find(x, y, z, sphere.color, dz=-1)
-
-    def get_neighbors(self, x, y, z):
-        for nx, ny, nz in [(x + 1, y, z), (x - 1, y, z), (x, y + 1, z),
-                           (x, y - 1, z), (x, y, z + 1), (x, y, z - 1)]:
-            if 0 <= nx < self.size and 0 <= ny < self.size and 0 <= nz < self.size:
-                yield nx, ny, nz
-
-    def is_deletable(self, x, y, z):
-        for nx, ny, nz in self.get_neighbors(x, y, z):
-            if self.spheres[nx][ny][nz].color == self.spheres[x][y][z].color:
-                return True
-        return False
+        self.status = Status.MOVE
+        if not self.move():
+            self.settled()
+
+    def settled(self):
+        self.store.hide(self.board)
+        if self.can_continue():
+            self.status = Status.PLAY
+        else:
+            self.status = Status.GAMEOVER
+            self.show_gameover_screen()
 
+    def update(self, task):
+        dt = globalClock.getDt()
+        profiler.frame(dt)
+
+        with profiler.section(f'update.{self.status.name}'):
+            if self.status == Status.PLAY:
+                arrows = [arrow for arrow in Arrow if inputState.isSet(arrow.key)]
+                if self.session_recorder:
+                    self.session_recorder.frame += 1
+                    if arrows:
+                        self.session_recorder.rotate(arrows_to_mask(arrows, list(Arrow)), dt)
+                self.rotate(arrows, dt)
+                if hover_preview:
+                    self.hover(bool(arrows))
+            elif self.hovered is not None:
+                self.hovered = None
+                self.preview.display(0)
+
+        return task.cont
+
+    def hover(self, rotated):
+        """Show the number of spheres a click on the sphere under the mouse would delete,
+           picking again only after the mouse moved or the cube rotated.
+        """
+        if not (self.mouseWatcherNode and self.mouseWatcherNode.hasMouse()):
+            mouse = None
+        else:
+            mouse = tuple(self.mouseWatcherNode.getMouse())
+
+        if mouse != self.hovered or rotated:
+            self.hovered = mouse
+            tag = self.pick_lattice(Point2(*mouse)) if mouse else None
+            self.preview.display(self.board.group_size(tag) if tag is not None else 0)
+
+    def busy(self):
+        """Return True unless the game only waits for input with nothing moving.
+        """
+        return (self.status not in (Status.PLAY, Status.GAMEOVER)
+                or len(self.animator) > 0
+                or not self.scene.complete
+                or (self.scene.sun is not None and self.scene.sun.playing)
+                or any(inputState.isSet(arrow.key) for arrow in Arrow))
+
+    def profile_counters(self):
+        return [
+            ('status', self.status.name),
+            ('spheres alive', self.board.remaining()),
+            ('spheres hidden', int(self.store.hidden.sum())),
+            ('nodes', self.render.countNumDescendants()),
+            ('tweens', len(self.animator)),
+            ('quality', self.quality.tier.name),
+            ('idle', self.idle.active),
+        ]
+
+    def export_trace(self, path=PATH_TRACE):
+        profiler.export(path)
+
+    def rotate(self, arrows, dt):
+        """arrows: the Arrow members held down
+        """
+        velocity = 0
+        axis = Vec3.forward()
+
+        if Arrow.UP in arrows:
+            velocity += 10
+        elif Arrow.DOWN in arrows:
+            velocity -= 10
+        elif Arrow.LEFT in arrows:
+            velocity += 10
+            axis = Vec3.up()
+        elif Arrow.RIGHT in arrows:
+            velocity -= 10
+            axis = Vec3.up()
+
+        if rotation_angle := velocity * dt:
+            self.sphere_root.rotate_around(rotation_angle, axis)
+
+    @profiler.trace('move')
     def move(self):
-        if destinations := [cell for cell in self.set_destinations()]:
-            self.sphere_moving = Parallel(
-                *[c.move_model() for c in destinations if c.destination])
-            self.sphere_moving.start()
+        with profiler.section('settle'):
+            moves = self.board.settle()
+
+        if moves:
+            sources, destinations = np.array(moves).T
+            models = self.store.transfer(sources, destinations).tolist()
+            self.store.expose(self.board, np.concatenate([sources, destinations]))
+
+            for model, tag in zip(models, destinations.tolist()):
+                model.find('**/Sphere').node().setTag('sphere', str(tag))
+            self.animator.move(
+                models,
+                [model.getPos() for model in models],
+                self.store.positions[destinations],
+                MOVE_TIME, 0, self.animator.group(self.settled)
+            )
             return True
         return False
 
-    def set_destinations(self):
-        for x, y, z in itertools.product(range(self.size), repeat=3):
-            if (sphere := self.spheres[x][y][z]).color:
-                if empty_cells := [c for c in self.empty_cells(x, y, z)]:
-                    empty_cell = min(empty_cells, key=lambda x: x.distance)
-                    if empty_cell.distance < sphere.distance:
-                        sphere.set_destination(empty_cell)
-                        yield empty_cell
-                        yield from self.set_destinations()
-                        break
-
-    def empty_cells(self, x, y, z):
-        for nx, ny, nz in self.get_neighbors(x, y, z):
-            if not self.spheres[nx][ny][nz].color:
-                yield self.spheres[nx][ny][nz]
-
-    def _initialize(self, size):
-        self.sphere_moving = None
-        self.size = size
-        self.scoreboard.display(0)
-        self.setup_spheres()
+    def _initialize(self, size, saved=None):
+        if saved:
+            self.restore(saved)
+        else:
+            self.size = size
+            self.scoreboard.display(0)
+            self.new_board()
+            self.setup_spheres()
+
+        if self.session_recorder:
+            self.session_recorder.board(self.saved_game(), Event.RESTART)
+        if self.server:
+            self.call_server(self.server.reset, self.saved_game())
 
     def show_gameover_screen(self):
         self.gameover_gui.reparentTo(self.aspect2d)
@@ -390,28 +889,33 @@ class Game(ShowBase):
         msg = 'You Won!' if self.scoreboard.total == self.size ** 3 else 'Game Over'
         self.gameover_gui.msg.setText(msg)
         self.gameover_gui.set_size_option(self.size)
+        if self.session_recorder:
+            self.session_recorder.gameover(self.scoreboard.total)
 
-    def restart_game(self):
-        self.gameover_seq = Sequence(
-            Wait(0.3),
-            Func(lambda: self.gameover_gui.detachNode()),
-            Wait(0.5)
-        )
-        if left_spheres := [s.disappear() for x, y, z in itertools.product(range(self.size), repeat=3)
-                            if (s := self.spheres[x][y][z]).color]:
-            self.gameover_seq.extend([Parallel(*left_spheres), Wait(0.5)])
-
-        size = self.gameover_gui.option_menu.get()
-        self.gameover_seq.append(Func(self._initialize, int(size)))
-        self.gameover_seq.start()
+    def restart_game(self, saved=None):
+        """saved: SavedGame to start with instead of a new random board
+        """
+        size = int(self.gameover_gui.option_menu.get())
+        left = np.flatnonzero(self.store.alive)
+
+        def start():
+            self._initialize(size, saved)
+            self.status = Status.PLAY
+
+        def cleared():
+            self.store.remove(left)
+            self.animator.wait(0.5, start)
+
+        self.animator.wait(0.3, self.gameover_gui.detachNode)
+        if len(left):
+            self.disappear(left, self.animator.group(cleared), 0.8)
+        else:
+            self.animator.wait(0.8, start)
         self.status = Status.RESTART
+        self.animator.flush()
 
     def can_continue(self):
-        for x, y, z in itertools.product(range(self.size), repeat=3):
-            if self.spheres[x][y][z].color:
-                if self.is_deletable(x, y, z):
-                    return True
-        return False
+        return self.board.can_continue()
 
 
 class GameoverScreen(NodePath):
@@ -454,7 +958,8 @@ class GameoverScreen(NodePath):
         )
 
     def set_size_option(self, size):
-        self.option_menu.set(self.size_options.index(str(size)))
+        if str(size) in self.size_options:
+            self.option_menu.set(self.size_options.index(str(size)))
 
 
 if __name__ == '__main__':
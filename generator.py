@@ -0,0 +1,210 @@
+"""Generate boards from seeds, grade them by simulated play, and keep the winnable ones
+in a pool on disk for the game to start from.
+
+    python generator.py --size 3 4 5 --boards 20     # fill the pool up to 20 boards per size and difficulty
+    python generator.py --status                     # show how many boards the pool holds
+
+The pool is a directory set by `board-pool` in Config.prc, holding one file of saved games
+per rule, size and difficulty.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+from panda3d.core import ConfigVariableString
+
+import savefile
+from board import Board, MAX_COLORS, RULES
+from savefile import SavedGame
+from selfplay import random_policy
+from solver import Solver
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# the mean share of the spheres a random player clears, from which on a board has the difficulty.
+DIFFICULTIES = (('easy', 0.9), ('normal', 0.86), ('hard', 0.0))
+
+board_pool = ConfigVariableString(
+    'board-pool', 'pool',
+    'Directory of the graded boards, relative to the game directory; empty to always generate new boards.')
+board_difficulty = ConfigVariableString(
+    'board-difficulty', 'any',
+    'easy, normal or hard to start from pooled boards of that difficulty; any takes from the fullest.')
+
+
+class Grade(NamedTuple):
+    seed: int
+    solvable: Optional[bool]   # None if neither a playout nor the search cleared it, and the search was cut off
+    win_rate: float            # the share of the random playouts which cleared the board
+    score_mean: float          # the spheres a random playout cleared on average
+    best: int                  # the most spheres cleared by any line found
+    difficulty: str
+
+
+def generate(size, seed=None, rule=RULES[0]):
+    """Return the board and the palette which the game draws from seed.
+    """
+    rng = np.random.default_rng(seed)
+    palette = tuple(rng.choice(MAX_COLORS, min(size, MAX_COLORS), replace=False).tolist())
+    return SavedGame(Board.random(size, len(palette), rng, rule), palette)
+
+
+def playout(board, rng):
+    board = board.copy()
+    total = 0
+    while board.can_continue():
+        total += len(board.play(random_policy(board, rng)))
+    return total
+
+
+def grade(size, seed, rule=RULES[0], playouts=16, nodes=500):
+    """Grade the board of seed by random playouts, and by a search of at most nodes
+       positions if none of the playouts cleared it.
+    """
+    board = generate(size, seed, rule).board
+    rng = np.random.default_rng([seed, 1])
+    scores = np.array([playout(board, rng) for _ in range(playouts)])
+    n_cells = board.remaining()
+    best = int(scores.max())
+
+    if best == n_cells:
+        solvable = True
+    else:
+        solution = Solver().solve(board, node_limit=nodes)
+        best = max(best, solution.score)
+        if best == n_cells:
+            solvable = True
+        else:
+            solvable = False if solution.complete else None
+
+    share = scores.mean() / n_cells
+    difficulty = next(name for name, least in DIFFICULTIES if share >= least)
+    return Grade(seed, solvable, float(np.mean(scores == n_cells)), float(scores.mean()), best, difficulty)
+
+
+def _grade(args):
+    return grade(*args)
+
+
+class BoardPool:
+    """Files of winnable boards, one per rule, size and difficulty. The boards of a file
+       are saved games of the same length, so the last one is taken by truncating the file.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(ROOT, path) if (path := board_pool.getValue()) else None
+        self.directory = directory
+
+    def path(self, size, rule, difficulty):
+        # the version keeps the files of another saved game format from being read.
+        return os.path.join(self.directory, f'{rule}-{size}-{difficulty}.v{savefile.VERSION}.pool')
+
+    def _record_size(self, size):
+        return savefile.HEADER.size + min(size, MAX_COLORS) + (size ** 3 + 1) // 2
+
+    def count(self, size, rule, difficulty):
+        if not self.directory or not os.path.exists(path := self.path(size, rule, difficulty)):
+            return 0
+        return os.path.getsize(path) // self._record_size(size)
+
+    def put(self, saved, rule, difficulty):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(saved.board.size, rule, difficulty), 'ab') as f:
+            f.write(savefile.pack(saved))
+
+    def take(self, size, rule, difficulty='any'):
+        """Remove a board from the pool and return it as a SavedGame, or None if there is none.
+           difficulty: the name of one of DIFFICULTIES, or any to take from the fullest file
+        """
+        names = [name for name, _ in DIFFICULTIES]
+        if difficulty != 'any' and difficulty not in names:
+            raise ValueError(f"board-difficulty must be one of {', '.join(names)} or any, not {difficulty}")
+
+        if not self.directory:
+            return None
+        if difficulty == 'any':
+            difficulty = max(names, key=lambda name: self.count(size, rule, name))
+        if not (count := self.count(size, rule, difficulty)):
+            return None
+
+        record = self._record_size(size)
+        with open(self.path(size, rule, difficulty), 'r+b') as f:
+            f.seek((count - 1) * record)
+            saved = savefile.unpack(f.read(record))
+            f.truncate((count - 1) * record)
+
+        return saved
+
+
+def fill(pool, size, boards, rule=RULES[0], workers=None, seed=None, attempts=None, playouts=16, nodes=500):
+    """Grade new boards until every difficulty of size has boards in the pool,
+       or attempts boards were graded. Return the grades and the seconds spent.
+    """
+    missing = {name: max(boards - pool.count(size, rule, name), 0) for name, _ in DIFFICULTIES}
+    attempts = attempts if attempts is not None else boards * len(DIFFICULTIES) * 20
+    # seeds are consecutive from a random start, so the boards of separate runs differ.
+    start = seed if seed is not None else int(np.random.SeedSequence().entropy % 2 ** 32)
+    tasks = ((size, start + i, rule, playouts, nodes) for i in range(attempts))
+    grades = []
+    began = time.perf_counter()
+
+    with multiprocessing.Pool(workers) as executor:
+        for g in executor.imap_unordered(_grade, tasks, chunksize=4):
+            grades.append(g)
+            if g.solvable and missing[g.difficulty]:
+                pool.put(generate(size, g.seed, rule), rule, g.difficulty)
+                missing[g.difficulty] -= 1
+            if not any(missing.values()):
+                executor.terminate()
+                break
+
+    return grades, time.perf_counter() - began
+
+
+def report(pool, sizes, rule):
+    names = [name for name, _ in DIFFICULTIES]
+    print(f"{'size':>4}" + ''.join(f'{name:>8}' for name in names))
+    for size in sizes:
+        print(f'{size:>4}' + ''.join(f'{pool.count(size, rule, name):>8}' for name in names))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate and grade CubicSameGame boards into the board pool.')
+    parser.add_argument('--size', type=int, nargs='+', default=[3, 4, 5], help='cube sizes')
+    parser.add_argument('--boards', type=int, default=20, help='boards to keep per size and difficulty')
+    parser.add_argument('--rule', choices=RULES, default=RULES[0], help='how a click finds the spheres to delete')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='worker processes')
+    parser.add_argument('--seed', type=int, help='first seed; random by default')
+    parser.add_argument('--attempts', type=int, help='boards graded at most per size')
+    parser.add_argument('--playouts', type=int, default=16, help='random playouts per board')
+    parser.add_argument('--nodes', type=int, default=500,
+                        help='positions searched per board if no playout cleared it')
+    parser.add_argument('--pool', help='use this pool directory instead of the configured one')
+    parser.add_argument('--status', action='store_true', help='only show how many boards the pool holds')
+    args = parser.parse_args()
+
+    pool = BoardPool(args.pool)
+    if not pool.directory:
+        sys.exit('the board pool is disabled by board-pool in Config.prc')
+
+    if not args.status:
+        print(f"{'size':>4}{'graded':>8}{'winnable':>10}{'unknown':>9}{'seconds':>9}{'boards/s/core':>15}")
+        for size in args.size:
+            grades, elapsed = fill(pool, size, args.boards, args.rule, args.workers, args.seed,
+                                   args.attempts, args.playouts, args.nodes)
+            winnable = sum(g.solvable is True for g in grades)
+            unknown = sum(g.solvable is None for g in grades)
+            rate = len(grades) / elapsed / args.workers
+            print(f'{size:>4}{len(grades):>8}{winnable:>10}{unknown:>9}{elapsed:>9.2f}{rate:>15.1f}')
+
+    report(pool, args.size, args.rule)
+
+
+if __name__ == '__main__':
+    main()
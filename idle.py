@@ -0,0 +1,67 @@
+from direct.showbase.DirectObject import DirectObject
+from direct.showbase.ShowBaseGlobal import globalClock
+from panda3d.core import ClockObject, ConfigVariableDouble
+
+
+idle_fps = ConfigVariableDouble(
+    'idle-fps', 5,
+    'The frame rate while the game waits for input with nothing moving; 0 never throttles.')
+idle_delay = ConfigVariableDouble(
+    'idle-delay', 2,
+    'Seconds without input before the frame rate is throttled.')
+
+
+class IdleScheduler(DirectObject):
+    """Throttle the frame rate and pause the backdrop while the game waits for input
+       and nothing moves, and return to the full rate on any input.
+    """
+
+    def __init__(self, game, busy):
+        """busy: function returning True while something moves or waits for the next frame
+        """
+        self.game = game
+        self.busy = busy
+        self.enabled = idle_fps.getValue() > 0
+        self.active = False
+        self.last_input = globalClock.getRealTime()
+        self.mouse = None
+
+        if game.buttonThrowers:
+            for thrower in game.buttonThrowers:
+                thrower.node().setButtonDownEvent('buttonDown')
+            self.accept('buttonDown', self.on_button)
+        game.taskMgr.add(self.update, 'idle', sort=-2)
+
+    def on_button(self, button):
+        self.last_input = globalClock.getRealTime()
+        self.wake()
+
+    def update(self, task):
+        now = globalClock.getRealTime()
+
+        if (watcher := self.game.mouseWatcherNode) and watcher.hasMouse():
+            if (mouse := tuple(watcher.getMouse())) != self.mouse:
+                self.mouse = mouse
+                self.last_input = now
+
+        if not self.enabled or self.busy():
+            self.last_input = now
+
+        if now - self.last_input < idle_delay.getValue():
+            self.wake()
+        elif not self.active:
+            self.sleep()
+
+        return task.cont
+
+    def wake(self):
+        if self.active:
+            self.active = False
+            globalClock.setMode(ClockObject.MNormal)
+            self.game.scene.resume()
+
+    def sleep(self):
+        self.active = True
+        globalClock.setMode(ClockObject.MLimited)
+        globalClock.setFrameRate(idle_fps.getValue())
+        self.game.scene.pause()
@@ -0,0 +1,201 @@
+import numpy as np
+
+from panda3d.core import NodePath, PandaNode, Texture, Shader, GeomEnums
+from panda3d.core import CollisionNode, CollisionSphere, OmniBoundingVolume, BitMask32
+
+
+VERT_SHADER = """
+#version 150
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat3 p3d_NormalMatrix;
+uniform samplerBuffer instance_data;
+
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+
+out vec3 view_pos;
+out vec3 normal;
+out vec4 color;
+
+void main() {
+    // two texels per instance: (x, y, z, scale) and (r, g, b, a)
+    vec4 offset = texelFetch(instance_data, gl_InstanceID * 2);
+    color = texelFetch(instance_data, gl_InstanceID * 2 + 1);
+
+    vec4 vertex = vec4(p3d_Vertex.xyz * offset.w + offset.xyz, 1);
+    gl_Position = p3d_ModelViewProjectionMatrix * vertex;
+    view_pos = vec3(p3d_ModelViewMatrix * vertex);
+    normal = p3d_NormalMatrix * p3d_Normal;
+}
+"""
+
+FRAG_SHADER = """
+#version 150
+
+uniform struct {
+    vec4 color;
+    vec4 position;
+} p3d_LightSource[2];
+
+uniform struct {
+    vec4 ambient;
+} p3d_LightModel;
+
+in vec3 view_pos;
+in vec3 normal;
+in vec4 color;
+
+out vec4 p3d_FragColor;
+
+void main() {
+    vec3 n = normalize(normal);
+    vec3 light = p3d_LightModel.ambient.rgb;
+
+    for (int i = 0; i < p3d_LightSource.length(); ++i) {
+        vec4 pos = p3d_LightSource[i].position;
+        vec3 to_light = normalize(pos.xyz - view_pos * pos.w);
+        light += p3d_LightSource[i].color.rgb * max(dot(n, to_light), 0.0);
+    }
+    p3d_FragColor = vec4(color.rgb * min(light, vec3(1.0)), color.a);
+}
+"""
+
+SPHERE_RADIUS = 3.28
+
+
+class SphereInstances(NodePath):
+    """Draw count spheres with a single draw call. The position, scale and color
+       of each instance are held in a buffer texture read by the vertex shader.
+    """
+
+    def __init__(self, model, count):
+        """model: NodePath of the sphere, which is flattened into the shared geometry
+        """
+        super().__init__(PandaNode('sphereInstances'))
+        self.count = count
+        self.free = list(range(count - 1, -1, -1))   # the slots no instance holds, lowest last
+        self.tex = Texture('instanceData')
+        self.tex.setupBufferTexture(count * 2, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+        self.tex.setClearColor((0, 0, 0, 0))
+
+        model.flattenStrong()
+        self.geom = model.find('**/+GeomNode')
+        self.geom.reparentTo(self)
+        self.geom.setInstanceCount(count)
+        self.geom.node().setBounds(OmniBoundingVolume())
+        self.geom.node().setFinal(True)
+        self.geom.setShader(Shader.make(Shader.SL_GLSL, vertex=VERT_SHADER, fragment=FRAG_SHADER))
+        self.geom.setShaderInput('instance_data', self.tex)
+
+        self.colliders = self.attachNewNode(PandaNode('colliders'))
+
+    def set_model(self, model):
+        """Draw the instances with the geometry of another sphere model.
+        """
+        model.flattenStrong()
+        self.geom.node().removeAllGeoms()
+        self.geom.node().addGeomsFrom(model.find('**/+GeomNode').node())
+
+    def _data(self):
+        return np.frombuffer(self.tex.modifyRamImage(), dtype=np.float32).reshape(self.count, 2, 4)
+
+    def update(self, slot, pos=None, scale=None, color=None):
+        data = self._data()
+        if pos is not None:
+            data[slot, 0, :3] = tuple(pos)
+        if scale is not None:
+            data[slot, 0, 3] = scale
+        if color is not None:
+            data[slot, 1] = tuple(color)
+
+    def set_positions(self, instances, positions):
+        """instances: SphereInstance of this object
+           positions: array of shape (len(instances), 3)
+        """
+        slots = [instance.slot for instance in instances]
+        self._data()[slots, 0, :3] = positions
+        for instance, (x, y, z) in zip(instances, positions.tolist()):
+            instance.collider.setPos(x, y, z)
+
+    def set_scales(self, instances, scales):
+        slots = [instance.slot for instance in instances]
+        self._data()[slots, 0, 3] = scales
+        for instance, scale in zip(instances, scales.tolist()):
+            instance.collider.setScale(scale)
+
+    def create_instance(self, tag, color, pos, scale):
+        """Create an instance in a free slot, which it holds until it is removed.
+        """
+        if not self.free:
+            raise RuntimeError(f'all {self.count} sphere instances are in use')
+        slot = self.free.pop()
+
+        node = CollisionNode('Sphere')
+        node.addSolid(CollisionSphere(0, 0, 0, SPHERE_RADIUS))
+        node.setIntoCollideMask(BitMask32.bit(1))
+        node.setTag('sphere', str(tag))
+        collider = self.colliders.attachNewNode(node)
+        collider.setPos(pos)
+        collider.setScale(scale)
+
+        self.update(slot, pos=pos, scale=scale, color=color)
+        return SphereInstance(self, slot, collider)
+
+
+class SphereInstance:
+    """Stand-in for a sphere model NodePath, backed by one instance slot.
+    """
+
+    def __init__(self, instances, slot, collider):
+        self.instances = instances
+        self.slot = slot
+        self.collider = collider
+
+    def getParent(self):
+        return self.instances
+
+    def getPos(self):
+        return self.collider.getPos()
+
+    def setPos(self, pos):
+        self.collider.setPos(pos)
+        self.instances.update(self.slot, pos=pos)
+
+    def getScale(self):
+        return self.collider.getScale().x
+
+    def setScale(self, scale):
+        self.collider.setScale(scale)
+        self.instances.update(self.slot, scale=scale)
+
+    def find(self, path):
+        return self.collider
+
+    def stash(self):
+        self.instances.update(self.slot, scale=0)
+        self.collider.stash()
+
+    def unstash(self):
+        self.collider.unstash()
+        self.instances.update(self.slot, scale=self.getScale())
+
+    def removeNode(self):
+        self.instances.update(self.slot, scale=0)
+        self.instances.free.append(self.slot)
+        self.collider.removeNode()
+
+    def release(self):
+        """Hide the instance and detach its collider, keeping both to be reused.
+        """
+        self.instances.update(self.slot, scale=0)
+        self.collider.detachNode()
+
+    def reuse(self, tag, color, pos, scale):
+        self.collider.reparentTo(self.instances.colliders)
+        self.collider.setPos(pos)
+        self.collider.setScale(scale)
+        self.collider.node().setTag('sphere', str(tag))
+        self.instances.update(self.slot, pos=pos, scale=scale, color=color)
+        return self
@@ -1,5 +1,9 @@
 from panda3d.core import AmbientLight, DirectionalLight
-from panda3d.core import Point3, Vec3, LColor, NodePath
+from panda3d.core import Point3, Vec3, LColor, NodePath, BitMask32
+
+
+# the camera mask of the shadow map camera of BasicDayLight.
+SHADOW_MASK = BitMask32.bit(1)
 
 
 class BasicAmbientLight(NodePath):
@@ -12,14 +16,31 @@ class BasicAmbientLight(NodePath):
 
 
 class BasicDayLight(NodePath):
+    """The shadows need per-pixel lighting, which is left to the caller to enable.
+    """
 
-    def __init__(self):
+    def __init__(self, shadow_size=512):
         super().__init__(DirectionalLight('basicDayLight'))
         self.reparentTo(base.render)
         self.node().getLens().setFilmSize(200, 200)
         self.node().getLens().setNearFar(1, 100)
         self.node().setColor(LColor(1, 1, 1, 1))
+        self.node().setCameraMask(SHADOW_MASK)
         self.setPosHpr(Point3(0, 0, 30), Vec3(-30, -45, 0))
-        self.node().setShadowCaster(True)
-        base.render.setShaderAuto()
+        self.set_shadow_size(shadow_size)
         base.render.setLight(self)
+
+    def set_shadow_size(self, size):
+        """size: the resolution of the shadow map; 0 casts no shadows
+        """
+        if size:
+            self.node().setShadowCaster(True, size, size)
+        else:
+            self.node().setShadowCaster(False)
+
+    def cast_only(self, root):
+        """Render only root into the shadow map, leaving out the skybox and the planets.
+        """
+        base.cam.node().setCameraMask(base.cam.node().getCameraMask() & ~SHADOW_MASK)
+        base.render.hide(SHADOW_MASK)
+        root.showThrough(SHADOW_MASK)
@@ -0,0 +1,138 @@
+import numpy as np
+
+from direct.showbase.ShowBaseGlobal import globalClock
+from panda3d.core import Point3, Quat, lookAt
+
+from profiler import profiler
+
+
+SAMPLES = 360
+
+
+def _quats(quats):
+    """Return the quaternions as an array, flipping their signs where needed so that
+       each one is in the hemisphere of the one before it, and neighbors can be interpolated.
+    """
+    array = np.array([(q.getR(), q.getI(), q.getJ(), q.getK()) for q in quats], dtype=np.float32)
+    for i in range(1, len(array)):
+        if np.dot(array[i], array[i - 1]) < 0:
+            array[i] = -array[i]
+    return array
+
+
+def spin_path(pos, hpr, samples=SAMPLES):
+    """Return the positions and quaternions of a body at pos turning from 0 to hpr over one period.
+    """
+    quats = []
+    for t in np.linspace(0, 1, samples + 1):
+        q = Quat()
+        q.setHpr(hpr * float(t))
+        quats.append(q)
+
+    positions = np.tile(np.array(pos, dtype=np.float32), (samples + 1, 1))
+    return positions, _quats(quats)
+
+
+def orbit_path(center, start, axis, samples=SAMPLES):
+    """Return the positions and quaternions of a body going once around axis through center
+       from start, facing the direction it moves in.
+    """
+    axis = axis.normalized()
+    positions, quats = [], []
+
+    for t in np.linspace(0, 1, samples + 1):
+        q = Quat()
+        q.setFromAxisAngle(360 * float(t), axis)
+        r = q.xform(start - center)
+        positions.append(center + r)
+
+        facing = Quat()
+        lookAt(facing, axis.cross(r), axis)
+        quats.append(facing)
+
+    return np.array(positions, dtype=np.float32), _quats(quats)
+
+
+class Orbits:
+    """The periodic motions of the backdrop bodies, sampled once into tables and played
+       by one task which looks up where every body is at the frame time.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.positions = np.zeros((0, SAMPLES + 1, 3), dtype=np.float32)
+        self.quats = np.zeros((0, SAMPLES + 1, 4), dtype=np.float32)
+        self.periods = np.zeros(0, dtype=np.float64)
+        self.start_times = np.zeros(0, dtype=np.float64)
+        self.loops = np.zeros(0, dtype=bool)
+        self.playing = np.zeros(0, dtype=bool)
+
+        self.callbacks = {}   # index: function called when the motion ends
+        self.paused_at = None
+
+    def start(self):
+        base.taskMgr.add(self.update, 'orbit')
+
+    def add(self, node, path, period, loop=True):
+        """Add the motion of node, which plays at once if it loops; return its index.
+           path: the positions and quaternions returned by spin_path or orbit_path
+        """
+        positions, quats = path
+        self.nodes.append(node)
+        self.positions = np.concatenate([self.positions, positions[np.newaxis]])
+        self.quats = np.concatenate([self.quats, quats[np.newaxis]])
+        self.periods = np.append(self.periods, period)
+        self.start_times = np.append(self.start_times, globalClock.getFrameTime())
+        self.loops = np.append(self.loops, loop)
+        self.playing = np.append(self.playing, loop)
+        return len(self.nodes) - 1
+
+    def play(self, index, callback=None):
+        """Play the motion once from its start; callback is called when it ends.
+        """
+        self.start_times[index] = globalClock.getFrameTime()
+        self.playing[index] = True
+        if callback:
+            self.callbacks[index] = callback
+
+    def is_playing(self, index):
+        return bool(self.playing[index])
+
+    def pause(self):
+        if self.paused_at is None:
+            self.paused_at = globalClock.getFrameTime()
+
+    def resume(self):
+        if self.paused_at is not None:
+            self.start_times += globalClock.getFrameTime() - self.paused_at
+            self.paused_at = None
+
+    def update(self, task):
+        if self.paused_at is None:
+            self.step(globalClock.getFrameTime())
+        return task.cont
+
+    @profiler.trace('orbits.update', 'scene')
+    def step(self, now):
+        if not len(indices := np.flatnonzero(self.playing)):
+            return
+
+        phases = (now - self.start_times[indices]) / self.periods[indices]
+        finished = ~self.loops[indices] & (phases >= 1)
+        phases = np.where(finished, 1, phases % 1) * SAMPLES
+
+        i = np.minimum(phases.astype(np.int64), SAMPLES - 1)
+        t = (phases - i)[:, np.newaxis]
+        positions = self.positions[indices, i] * (1 - t) + self.positions[indices, i + 1] * t
+        quats = self.quats[indices, i] * (1 - t) + self.quats[indices, i + 1] * t
+        quats /= np.linalg.norm(quats, axis=1)[:, np.newaxis]
+
+        for index, pos, q in zip(indices.tolist(), positions.tolist(), quats.tolist()):
+            self.nodes[index].setPosQuat(Point3(*pos), Quat(*q))
+
+        if finished.any():
+            done = indices[finished].tolist()
+            self.playing[done] = False
+            for index in done:
+                if callback := self.callbacks.pop(index, None):
+                    callback()
@@ -0,0 +1,69 @@
+import math
+
+
+def _hits_sphere(origin, direction, center, radius):
+    oc = [origin[i] - center[i] for i in range(3)]
+    a = sum(d * d for d in direction)
+    b = sum(oc[i] * direction[i] for i in range(3))
+    c = sum(v * v for v in oc) - radius ** 2
+    disc = b * b - a * c
+
+    if disc < 0:
+        return False
+    # the far intersection must be in front of the ray origin.
+    return -b + math.sqrt(disc) >= 0
+
+
+def pick_cell(cells, origin, direction, radius, spacing=2, skip=None):
+    """Walk the lattice cells the ray passes through, nearest first (3D DDA),
+       and return the (x, y, z) of the first occupied cell whose sphere the ray hits,
+       or None. origin and direction are given in the cube's local frame, in which
+       the cell (x, y, z) is centered at ((x - (size - 1) / 2) * spacing, ...).
+       skip: array shaped as cells, True for the cells the ray passes as if they were empty
+    """
+    size = cells.shape[0]
+    half = size * spacing / 2
+    # grid coordinates: the cube spans [0, size) along every axis.
+    o = [(origin[i] + half) / spacing for i in range(3)]
+    d = [direction[i] / spacing for i in range(3)]
+
+    t_enter, t_exit = 0.0, math.inf
+    for i in range(3):
+        if d[i] == 0:
+            if not 0 <= o[i] <= size:
+                return None
+        else:
+            ta, tb = (0 - o[i]) / d[i], (size - o[i]) / d[i]
+            t_enter = max(t_enter, min(ta, tb))
+            t_exit = min(t_exit, max(ta, tb))
+    if t_enter > t_exit:
+        return None
+
+    cell = [min(max(int(o[i] + d[i] * t_enter), 0), size - 1) for i in range(3)]
+    step = [1 if d[i] > 0 else -1 for i in range(3)]
+    t_max = []
+    t_delta = []
+
+    for i in range(3):
+        if d[i] == 0:
+            t_max.append(math.inf)
+            t_delta.append(math.inf)
+        else:
+            boundary = cell[i] + (1 if d[i] > 0 else 0)
+            t_max.append((boundary - o[i]) / d[i])
+            t_delta.append(abs(1 / d[i]))
+
+    while True:
+        x, y, z = cell
+        if cells[x, y, z] and (skip is None or not skip[x, y, z]):
+            center = [(c - (size - 1) / 2) * spacing for c in cell]
+            if _hits_sphere(origin, direction, center, radius):
+                return x, y, z
+
+        axis = t_max.index(min(t_max))
+        if t_max[axis] > t_exit:
+            return None
+        cell[axis] += step[axis]
+        if not 0 <= cell[axis] < size:
+            return None
+        t_max[axis] += t_delta[axis]
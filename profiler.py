@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+from direct.gui.DirectGui import OnscreenText
+from panda3d.core import TextNode
+
+
+class Profiler:
+    """Measure named sections of the game loop while enabled. The recent durations
+       of each section and of whole frames are kept for percentiles, and every section
+       is kept as a trace event which can be exported for chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, window=300, max_events=200_000):
+        self.enabled = False
+        self.window = window
+        self.frame_times = deque(maxlen=window)
+        self.durations = defaultdict(lambda: deque(maxlen=window))
+        self.events = deque(maxlen=max_events)
+
+    def clear(self):
+        self.frame_times.clear()
+        self.durations.clear()
+        self.events.clear()
+
+    @contextmanager
+    def section(self, name, cat='game'):
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self.durations[name].append(elapsed / 1e6)
+            self.events.append((name, cat, start, elapsed, threading.get_ident()))
+
+    def trace(self, name, cat='game'):
+        """Decorator measuring every call of the function as a section.
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.section(name, cat):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def frame(self, dt):
+        if self.enabled:
+            self.frame_times.append(dt * 1000)
+
+    def percentiles(self, name=None, ps=(50, 95, 99)):
+        """Return the percentiles in ms of the frame times, or of the section name.
+        """
+        values = self.frame_times if name is None else self.durations.get(name, ())
+        if not values:
+            return [0.0] * len(ps)
+        return np.percentile(np.fromiter(values, dtype=float), ps).tolist()
+
+    def export(self, path):
+        """Write the trace events in the Chrome trace event format.
+        """
+        pid = os.getpid()
+        events = [
+            {'name': name, 'cat': cat, 'ph': 'X', 'ts': start / 1000, 'dur': elapsed / 1000,
+             'pid': pid, 'tid': tid}
+            for name, cat, start, elapsed, tid in self.events
+        ]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+profiler = Profiler()
+
+
+class ProfilerOverlay(OnscreenText):
+
+    def __init__(self, counters, interval=0.25):
+        """counters: function returning the (label, value) pairs to show under the timings
+        """
+        super().__init__(
+            parent=base.a2dTopRight,
+            fg=(1, 1, 0, 1),
+            bg=(0, 0, 0, 0.5),
+            pos=(-0.06, -0.1),
+            align=TextNode.ARight,
+            scale=0.045,
+            mayChange=True
+        )
+        self.counters = counters
+        self.interval = interval
+        self.hide()
+
+    def toggle(self):
+        if self.isHidden():
+            profiler.enabled = True
+            self.show()
+            base.taskMgr.doMethodLater(self.interval, self.refresh, 'refreshProfilerOverlay')
+        else:
+            self.hide()
+            base.taskMgr.remove('refreshProfilerOverlay')
+
+    def refresh(self, task):
+        p50, p95, p99 = profiler.percentiles()
+        lines = [f'frame ms  p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f}']
+
+        for name in sorted(profiler.durations):
+            p50, p95, p99 = profiler.percentiles(name)
+            lines.append(f'{name}  p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f}')
+        lines.extend(f'{label}: {value}' for label, value in self.counters())
+
+        self.setText('\n'.join(lines))
+        return task.again
@@ -0,0 +1,189 @@
+"""Render quality tiers, from the cheapest to the best looking.
+
+`render-quality` in Config.prc selects a tier by name, or `auto` to start from the best one
+and step down or up while the measured frame rate misses or easily beats `target-fps`.
+"""
+import functools
+import math
+import statistics
+from typing import NamedTuple
+
+from direct.showbase.ShowBaseGlobal import globalClock
+from panda3d.core import ConfigVariableInt, ConfigVariableString
+from panda3d.core import Geom, GeomTriangles, GeomVertexData, GeomVertexFormat, GeomVertexWriter
+
+from assets import assets
+
+
+render_quality = ConfigVariableString(
+    'render-quality', 'auto',
+    'minimal, low, medium or high; auto steps between them to hold target-fps.')
+target_fps = ConfigVariableInt(
+    'target-fps', 30,
+    'The frame rate the auto render quality tries to hold.')
+
+
+class Tier(NamedTuple):
+    name: str
+    shadow_size: int          # resolution of the shadow map; 0 casts no shadows
+    per_pixel: bool           # light the spheres with the shader generator instead of fixed-function
+    per_pixel_backdrop: bool  # light the backdrop with the shader generator too
+    sphere_detail: str        # 'high' for the sphere model, 'low' for a coarser sphere
+
+
+TIERS = (
+    Tier('minimal', 0, False, False, 'low'),
+    Tier('low', 0, True, False, 'high'),
+    Tier('medium', 512, True, False, 'high'),
+    Tier('high', 2048, True, True, 'high'),
+)
+
+
+@functools.lru_cache(maxsize=None)
+def coarse_sphere(rings=5, segments=8):
+    """Return a Geom of a unit sphere with far fewer triangles than the sphere model.
+    """
+    vdata = GeomVertexData('coarseSphere', GeomVertexFormat.getV3n3t2(), Geom.UHStatic)
+    vdata.setNumRows((rings + 1) * (segments + 1))
+    vertex = GeomVertexWriter(vdata, 'vertex')
+    normal = GeomVertexWriter(vdata, 'normal')
+    texcoord = GeomVertexWriter(vdata, 'texcoord')
+
+    for r in range(rings + 1):
+        theta = math.pi * r / rings
+        for s in range(segments + 1):
+            phi = 2 * math.pi * s / segments
+            x, y, z = math.sin(theta) * math.cos(phi), math.sin(theta) * math.sin(phi), math.cos(theta)
+            vertex.addData3(x, y, z)
+            normal.addData3(x, y, z)
+            texcoord.addData2(s / segments, 1 - r / rings)
+
+    tris = GeomTriangles(Geom.UHStatic)
+    for r in range(rings):
+        for s in range(segments):
+            a = r * (segments + 1) + s
+            b = a + segments + 1
+            if r > 0:
+                tris.addVertices(a, b, a + 1)
+            if r < rings - 1:
+                tris.addVertices(a + 1, b, b + 1)
+
+    geom = Geom(vdata)
+    geom.addPrimitive(tris)
+    return geom
+
+
+def sphere_model(path, detail):
+    """Return a copy of the sphere model at path; if detail is 'low',
+       its geometry is replaced by coarse_sphere.
+    """
+    model = assets.copy_model(path)
+    if detail == 'low':
+        node = model.find('**/+GeomNode').node()
+        state = node.getGeomState(0)
+        node.removeAllGeoms()
+        node.addGeom(coarse_sphere(), state)
+    return model
+
+
+def set_geoms(node, source):
+    """Replace the geoms of the GeomNode by the ones of source; the Geom objects are shared, not copied.
+    """
+    node.removeAllGeoms()
+    node.addGeomsFrom(source)
+
+
+class Quality:
+    """Apply the render quality tiers to a game, stepping between them in auto mode.
+    """
+
+    def __init__(self, game, window=2.0, backoff=30.0):
+        """window: seconds of frames measured before each decision
+           backoff: seconds a tier is not tried again after it was too slow; doubled every time
+        """
+        self.game = game
+        self.window = window
+        self.backoff = backoff
+        names = [tier.name for tier in TIERS]
+
+        if (name := render_quality.getValue()) == 'auto':
+            self.auto = True
+            self.index = len(TIERS) - 1
+        elif name in names:
+            self.auto = False
+            self.index = names.index(name)
+        else:
+            raise ValueError(f"render-quality must be one of {', '.join(names)} or auto, not {name}")
+
+        self.frame_times = []
+        self.measured = 0
+        self.skip = 1
+        self.blocked = {}   # tier index: (time until which it is not tried, backoff)
+
+    @property
+    def tier(self):
+        return TIERS[self.index]
+
+    def start(self):
+        self.apply()
+        if self.auto:
+            base.taskMgr.add(self.update, 'adjustQuality')
+
+    def apply(self):
+        """Apply the tier to the game; called again once the day light exists.
+        """
+        tier, game = self.tier, self.game
+
+        if tier.per_pixel_backdrop:
+            base.render.setShaderAuto()
+        else:
+            base.render.clearShader()
+
+        if tier.per_pixel:
+            game.sphere_root.setShaderAuto()
+        else:
+            game.sphere_root.clearShader()
+
+        if game.day_light:
+            game.day_light.set_shadow_size(tier.shadow_size)
+            game.day_light.cast_only(game.sphere_root)
+
+        game.sphere_root.set_detail(tier.sphere_detail)
+
+    def step(self, direction):
+        now = globalClock.getFrameTime()
+        if direction < 0:
+            _, backoff = self.blocked.get(self.index, (0, self.backoff / 2))
+            self.blocked[self.index] = (now + backoff * 2, backoff * 2)
+
+        self.index += direction
+        self.apply()
+        # the frames right after a change pay for compiling shaders and uploading geometry.
+        self.skip = 1
+
+    def update(self, task):
+        # the frame rate is throttled on purpose while the game is idle.
+        if self.game.idle.active:
+            return task.cont
+
+        dt = globalClock.getDt()
+        self.frame_times.append(dt)
+        self.measured += dt
+        if self.measured < self.window:
+            return task.cont
+
+        frame_ms = statistics.median(self.frame_times) * 1000
+        target_ms = 1000 / target_fps.getValue()
+        self.frame_times.clear()
+        self.measured = 0
+
+        if self.skip:
+            self.skip -= 1
+        elif frame_ms > target_ms * 1.2 and self.index > 0:
+            self.step(-1)
+        elif frame_ms < target_ms * 0.5 and self.index < len(TIERS) - 1:
+            until, _ = self.blocked.get(self.index + 1, (0, 0))
+            if globalClock.getFrameTime() >= until:
+                self.step(1)
+
+        return task.cont
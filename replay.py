@@ -0,0 +1,263 @@
+"""Record the input of a game session and replay it.
+
+    python replay.py session.rec             # replay the logic only, as fast as possible
+    python replay.py session.rec --render    # replay in the game window at normal speed
+
+A session is recorded by setting `record-input session.rec` in Config.prc.
+The log is a file header followed by records of (frame, kind, payload length) and a payload.
+frame counts the frames in which the game waited for input (Status.PLAY),
+so the log does not depend on how long animations took.
+"""
+import argparse
+import struct
+import sys
+import time
+from enum import IntEnum
+
+import savefile
+
+
+MAGIC = b'CSGR'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sB')
+RECORD = struct.Struct('<IBH')
+CLICK = struct.Struct('<I')
+ROTATE = struct.Struct('<Bf')
+TOTAL = struct.Struct('<I')
+
+
+class Event(IntEnum):
+
+    BOARD = 1      # a saved game replaced the board while playing
+    RESTART = 2    # a new game started from the game over screen with this board
+    CLICK = 3      # the tag of the clicked sphere
+    ROTATE = 4     # the arrows held down as a bit mask, and the frame time
+    GAMEOVER = 5   # the total score at game over
+
+
+def arrows_to_mask(arrows, members):
+    return sum(1 << i for i, arrow in enumerate(members) if arrow in arrows)
+
+
+def mask_to_arrows(mask, members):
+    return [arrow for i, arrow in enumerate(members) if mask & (1 << i)]
+
+
+class Recorder:
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self.frame = 0
+
+    def _write(self, kind, payload):
+        self.file.write(RECORD.pack(self.frame, kind, len(payload)))
+        self.file.write(payload)
+
+    def board(self, saved, kind=Event.BOARD):
+        self._write(kind, savefile.pack(saved))
+
+    def click(self, tag):
+        self._write(Event.CLICK, CLICK.pack(tag))
+
+    def rotate(self, mask, dt):
+        self._write(Event.ROTATE, ROTATE.pack(mask, dt))
+
+    def gameover(self, total):
+        self._write(Event.GAMEOVER, TOTAL.pack(total))
+
+    def close(self):
+        self.file.close()
+
+
+def read(path):
+    """Return the records of a session as a list of (frame, Event, value).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < FILE_HEADER.size:
+        raise ValueError('not a session log: too short')
+    magic, version = FILE_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a session log: bad magic')
+    if version != VERSION:
+        raise ValueError(f'unsupported session log version {version}')
+
+    records = []
+    offset = FILE_HEADER.size
+
+    while offset < len(data):
+        # a log is cut short when the game is killed before the recorder closes it.
+        if len(data) - offset < RECORD.size:
+            raise ValueError('truncated session log')
+        frame, kind, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if len(data) - offset < length:
+            raise ValueError('truncated session log')
+        payload = data[offset:offset + length]
+        offset += length
+
+        if kind in (Event.BOARD, Event.RESTART):
+            value = savefile.unpack(payload)
+        elif kind == Event.CLICK:
+            value, = CLICK.unpack(payload)
+        elif kind == Event.ROTATE:
+            value = ROTATE.unpack(payload)
+        elif kind == Event.GAMEOVER:
+            value, = TOTAL.unpack(payload)
+        else:
+            raise ValueError(f'unknown event {kind} in session log')
+        records.append((frame, Event(kind), value))
+
+    return records
+
+
+def fast_forward(records):
+    """Replay the logic of a session without any animation.
+       Return the total score of each game and the games whose total differs from the recorded one.
+    """
+    board, total = None, 0
+    totals, mismatches = [], []
+
+    for frame, kind, value in records:
+        if kind in (Event.BOARD, Event.RESTART):
+            board, total = value.board.copy(), value.total
+        elif kind == Event.CLICK:
+            total += len(board.play(value))
+        elif kind == Event.GAMEOVER:
+            totals.append(total)
+            if total != value or board.can_continue():
+                mismatches.append((len(totals) - 1, value, total))
+
+    return totals, mismatches
+
+
+class Replayer:
+    """Feed a recorded session to a running Game, frame by frame.
+    """
+
+    def __init__(self, game, records, exit_at_end=False):
+        """exit_at_end: exit the program when the records run out, with 1 if any game mismatched
+        """
+        self.game = game
+        self.records = records
+        self.exit_at_end = exit_at_end
+        self.cursor = 0
+        self.frame = 0
+        self.games = 0
+        self.mismatches = []   # the descriptions of where the replay diverged from the records
+
+    def start(self):
+        # the replayed input does not go through the input devices, so the game must not idle.
+        self.game.idle.enabled = False
+        self.game.taskMgr.add(self.update, 'replay', sort=-1)
+
+    def update(self, task):
+        from cubic_same_game import Arrow, Status
+
+        game = self.game
+        if self.cursor >= len(self.records):
+            # the animation of the last click ends before the results are reported.
+            if game.status in (Status.PLAY, Status.GAMEOVER):
+                self.finish()
+                return task.done
+            return task.cont
+
+        _, kind, value = self.records[self.cursor]
+
+        if game.status == Status.PLAY:
+            self.frame += 1
+            while self.cursor < len(self.records):
+                frame, kind, value = self.records[self.cursor]
+                if frame > self.frame:
+                    break
+                self.cursor += 1
+
+                if kind == Event.BOARD:
+                    game.restore(value)
+                elif kind == Event.ROTATE:
+                    mask, dt = value
+                    game.rotate(mask_to_arrows(mask, list(Arrow)), dt)
+                elif kind == Event.GAMEOVER:
+                    self.mismatch(f'recorded game over with total {value}, '
+                                  f'but the game goes on with {game.scoreboard.total}')
+                    self.games += 1
+                elif kind == Event.RESTART:
+                    game.restart_game(value)
+                    break
+                elif not game.board.cells.reshape(-1)[value]:
+                    self.mismatch(f'the recorded click on {value} found the cell empty')
+                else:
+                    game.delete(value)
+                    break
+        elif game.status == Status.GAMEOVER:
+            if kind == Event.GAMEOVER:
+                self.cursor += 1
+                if game.scoreboard.total != value:
+                    self.mismatch(f'recorded total {value}, replayed {game.scoreboard.total}')
+                self.games += 1
+            elif kind == Event.RESTART:
+                self.cursor += 1
+                game.restart_game(value)
+            else:
+                self.mismatch(f'the game is over with total {game.scoreboard.total}, but the recorded game goes on')
+                # skip the rest of the recorded game.
+                while self.cursor < len(self.records) \
+                        and self.records[self.cursor][1] not in (Event.GAMEOVER, Event.RESTART):
+                    self.cursor += 1
+
+        return task.cont
+
+    def mismatch(self, description):
+        self.mismatches.append(f'game {self.games}: {description}')
+        print(self.mismatches[-1])
+
+    def finish(self):
+        print(f'{self.games} games replayed, {len(self.mismatches)} mismatches')
+        if self.exit_at_end:
+            sys.exit(1 if self.mismatches else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded CubicSameGame session.')
+    parser.add_argument('log', nargs='+', help='session logs')
+    parser.add_argument('--render', action='store_true', help='replay in the game window at normal speed')
+    args = parser.parse_args()
+
+    if args.render:
+        try:
+            records = read(args.log[0])
+        except (OSError, ValueError) as e:
+            sys.exit(f'{args.log[0]}: {e}')
+
+        from cubic_same_game import Game
+        game = Game()
+        replayer = Replayer(game, records, exit_at_end=True)
+        replayer.start()
+        game.run()
+        return
+
+    failed = False
+    start = time.perf_counter()
+    for path in args.log:
+        try:
+            records = read(path)
+        except (OSError, ValueError) as e:
+            print(f'{path}: {e}')
+            failed = True
+            continue
+
+        totals, mismatches = fast_forward(records)
+        print(f'{path}: {len(totals)} games, totals {totals}')
+        for game, recorded, replayed in mismatches:
+            print(f'  game {game}: recorded total {recorded}, replayed {replayed}')
+            failed = True
+    print(f'replayed in {time.perf_counter() - start:.3f}s')
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Compact binary format of a game in progress.
+
+    header   magic b'CSG', version, cube size, palette length, rule, total score  (struct '<3sBBBBI')
+             rule is the index of the match rule in board.RULES; version 1 has no rule and plays LINES
+    palette  one byte per color: the index of the color in Colors
+    cells    one nibble per cell in tag order, high nibble first: 0 = empty,
+             otherwise 1 + the index of the color in the palette
+"""
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+from board import Board, LINES, MAX_COLORS, RULES
+
+
+MAGIC = b'CSG'
+VERSION = 2
+HEADER = struct.Struct('<3sBBBBI')
+HEADER_V1 = struct.Struct('<3sBBBI')
+
+
+class SavedGame(NamedTuple):
+    board: Board
+    palette: tuple
+    total: int = 0
+
+
+def pack(saved):
+    board, palette, total = saved
+    flat = board.cells.reshape(-1)
+    if len(flat) % 2:
+        flat = np.append(flat, 0)
+
+    return b''.join([
+        HEADER.pack(MAGIC, VERSION, board.size, len(palette), RULES.index(board.rule), total),
+        bytes(palette),
+        ((flat[0::2] << 4) | flat[1::2]).astype(np.uint8).tobytes(),
+    ])
+
+
+def unpack(data):
+    if len(data) < HEADER_V1.size:
+        raise ValueError('not a saved game: too short')
+
+    magic, version = data[:3], data[3]
+    if magic != MAGIC:
+        raise ValueError('not a saved game: bad magic')
+    if version == 1:
+        header = HEADER_V1
+        _, _, size, n_colors, total = header.unpack_from(data)
+        rule = LINES
+    elif version == VERSION:
+        header = HEADER
+        if len(data) < header.size:
+            raise ValueError('not a saved game: too short')
+        _, _, size, n_colors, rule, total = header.unpack_from(data)
+        if rule >= len(RULES):
+            raise ValueError(f'saved game has an unknown rule {rule}')
+        rule = RULES[rule]
+    else:
+        raise ValueError(f'unsupported saved game version {version}')
+
+    if not size:
+        raise ValueError('saved game has no cells')
+    if n_colors > MAX_COLORS:
+        raise ValueError(f'saved game has {n_colors} colors, more than {MAX_COLORS}')
+
+    n_cells = size ** 3
+    offset = header.size + n_colors
+    if len(data) != offset + (n_cells + 1) // 2:
+        raise ValueError('saved game has a wrong length')
+
+    palette = tuple(data[header.size:offset])
+    if any(color >= MAX_COLORS for color in palette):
+        raise ValueError('saved game has a color out of Colors')
+    packed = np.frombuffer(data, dtype=np.uint8, offset=offset)
+    cells = np.empty(len(packed) * 2, dtype=np.uint8)
+    cells[0::2] = packed >> 4
+    cells[1::2] = packed & 0x0F
+
+    cells = cells[:n_cells]
+    if cells.max(initial=0) > n_colors:
+        raise ValueError('saved game has a cell out of the palette')
+
+    return SavedGame(Board(cells.reshape((size,) * 3), rule), palette, total)
+
+
+def save(path, saved):
+    with open(path, 'wb') as f:
+        f.write(pack(saved))
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        return unpack(f.read())
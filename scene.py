@@ -1,8 +1,13 @@
-from direct.interval.IntervalGlobal import Sequence, Func
+import queue
+import threading
+
 from direct.showbase.ShowBase import ShowBase
-from panda3d.core import PandaNode, NodePath, Quat
+from panda3d.core import PandaNode, NodePath
 from panda3d.core import Vec3, Point3
 
+from assets import assets
+from orbit import Orbits, orbit_path, spin_path
+
 
 PATH_SPACE = 'models/space/solar_sky_sphere'
 PATH_SPACE_TEXTURE = 'models/space/stars_1k_tex.jpg'
@@ -15,100 +20,147 @@ PATH_SUN_TEXTURE = 'models/planets/sun_1k_tex.jpg'
 
 class CosmicSpace(NodePath):
 
-    def __init__(self):
+    def __init__(self, orbits):
         super().__init__(PandaNode('cosmicSpace'))
         self.reparentTo(base.render)
-        space = base.loader.loadModel(PATH_SPACE)
+        space = assets.copy_model(PATH_SPACE, self)
         space.setScale(40)
-        tex = base.loader.loadTexture(PATH_SPACE_TEXTURE)
-        space.setTexture(tex, 1)
-        space.reparentTo(self)
+        space.setTexture(assets.texture(PATH_SPACE_TEXTURE), 1)
 
 
 class Earth(NodePath):
 
-    def __init__(self):
+    def __init__(self, orbits):
         super().__init__(PandaNode('earth'))
         self.reparentTo(base.render)
-        earth = base.loader.loadModel(PATH_PLANETS)
-        earth.setTexture(base.loader.loadTexture(PATH_EARTH_TEXTURE), 1)
+        earth = assets.copy_model(PATH_PLANETS, self)
+        earth.setTexture(assets.texture(PATH_EARTH_TEXTURE), 1)
         earth.setScale(15)
-        earth.setPos(Point3(-30, 10, -20))
-        earth.reparentTo(self)
-        earth.hprInterval(120, Vec3(0, 360, 0)).loop()
+        orbits.add(earth, spin_path(Point3(-30, 10, -20), Vec3(0, 360, 0)), 120)
 
 
 class Moon(NodePath):
-    def __init__(self):
+    def __init__(self, orbits):
         super().__init__(PandaNode('moon'))
         self.reparentTo(base.render)
         center = Point3(-5, 30, 2)
-        moon = base.loader.loadModel(PATH_PLANETS)
-        moon.setTexture(base.loader.loadTexture(PATH_MOON_TEXTURE), 1)
+        moon = assets.copy_model(PATH_PLANETS, self)
+        moon.setTexture(assets.texture(PATH_MOON_TEXTURE), 1)
         moon.setScale(5)
-        moon.setPos(center)
-        moon.reparentTo(self)
-        moon.hprInterval(120, Vec3(0, 360, 0)).loop()
-        self.sattelite = Satellite(center, Vec3.right(), 30)
+        orbits.add(moon, spin_path(center, Vec3(0, 360, 0)), 120)
+        self.sattelite = Satellite(orbits, center, Vec3.right(), 30)
 
 
 class Satellite(NodePath):
 
-    def __init__(self, center, axis, velocity):
+    def __init__(self, orbits, center, axis, velocity):
+        """velocity: degrees per second around axis
+        """
         super().__init__(PandaNode('satellite'))
         self.reparentTo(base.render)
-        self.satellite = base.loader.loadModel(PATH_PLANETS)
-        self.satellite.setTexture(
-            base.loader.loadTexture(PATH_SATELLITE_TEXTURE), 1)
+        self.satellite = assets.copy_model(PATH_PLANETS, self)
+        self.satellite.setTexture(assets.texture(PATH_SATELLITE_TEXTURE), 1)
         self.satellite.setScale(0.3)
-        self.point = center
-        self.axis = axis
-        self.angular_velocity = velocity
-        self.satellite.setPos(Point3(-6, 20, 3))
-        self.satellite.reparentTo(self)
-
-    def rotate_around(self, time):
-        rotation_angle = self.angular_velocity * time
-        object_pos = self.satellite.getPos()
-        q = Quat()
-        q.setFromAxisAngle(rotation_angle, self.axis.normalized())
-        r = q.xform(object_pos - self.point)
-        rotated_pos = self.point + r
-        self.satellite.setPos(rotated_pos)
-
-        forward = self.axis.cross(r)
-        if rotation_angle < 0:
-            forward *= -1
-        self.satellite.lookAt(rotated_pos + forward, self.axis)
+        # a negative velocity goes the other way round the reversed axis.
+        if velocity < 0:
+            axis, velocity = -axis, -velocity
+        orbits.add(self.satellite, orbit_path(center, Point3(-6, 20, 3), axis), 360 / velocity)
 
 
 class Sun(NodePath):
 
-    def __init__(self):
+    def __init__(self, orbits):
         super().__init__(PandaNode('sun'))
         self.reparentTo(base.render)
-        self.sun = base.loader.loadModel(PATH_PLANETS)
-        self.sun.setTexture(base.loader.loadTexture(PATH_SUN_TEXTURE), 1)
+        self.sun = assets.copy_model(PATH_PLANETS)
+        self.sun.setTexture(assets.texture(PATH_SUN_TEXTURE), 1)
         self.sun.setScale(0.3)
         self.sun.setPos(Point3(0, 5, 10))
-        self.seq = Sequence(
-            self.hprInterval(5, Vec3(0, 360, 0)),
-            Func(lambda: self.sun.detachNode()),
-        )
+        self.orbits = orbits
+        self.orbit = orbits.add(self, spin_path(Point3(0, 0, 0), Vec3(0, 360, 0)), 5, loop=False)
+
+    @property
+    def playing(self):
+        return self.orbits.is_playing(self.orbit)
 
     def rotate_around(self):
-        if not self.seq.isPlaying():
+        if not self.playing:
             self.sun.reparentTo(self)
-            self.seq.start()
+            self.orbits.play(self.orbit, self.sun.detachNode)
 
 
 class Scene:
+    """The backdrop. Its models and textures can be loaded in a background thread,
+       each body being attached in the main thread as soon as its assets are ready.
+    """
+
+    stages = (
+        ('space', CosmicSpace, (PATH_SPACE,), (PATH_SPACE_TEXTURE,)),
+        ('moon', Moon, (PATH_PLANETS,), (PATH_MOON_TEXTURE, PATH_SATELLITE_TEXTURE)),
+        ('earth', Earth, (), (PATH_EARTH_TEXTURE,)),
+        ('sun', Sun, (), (PATH_SUN_TEXTURE,)),
+    )
 
     def __init__(self):
-        self.space = CosmicSpace()
-        self.moon = Moon()
-        self.earth = Earth()
-        self.sun = Sun()
+        self.space = None
+        self.moon = None
+        self.earth = None
+        self.sun = None
+        self.orbits = Orbits()
+        self.loaded = 0
+        self.ready = queue.Queue()
+
+    @property
+    def complete(self):
+        return self.loaded == len(self.stages)
+
+    def pause(self):
+        """Stop all the bodies, keeping where they are.
+        """
+        self.orbits.pause()
+
+    def resume(self):
+        self.orbits.resume()
+
+    def load(self, progress=None, threaded=True):
+        """progress: function called with the name of each stage attached, and the numbers
+                     of stages attached and of all stages
+        """
+        self.progress = progress
+        self.orbits.start()
+
+        if not threaded:
+            self._preload()
+            self.attach()
+            return
+
+        threading.Thread(target=self._preload, name='loadScene', daemon=True).start()
+        base.taskMgr.add(self.attach, 'attachScene')
+
+    def _preload(self):
+        try:
+            for name, _, models, textures in self.stages:
+                for path in models:
+                    assets.model(path)
+                for path in textures:
+                    assets.texture(path)
+                self.ready.put(name)
+        except Exception as e:
+            self.ready.put(e)
+
+    def attach(self, task=None):
+        while not self.ready.empty():
+            if isinstance(name := self.ready.get(), Exception):
+                raise name
+
+            body = next(cls for stage, cls, _, _ in self.stages if stage == name)
+            setattr(self, name, body(self.orbits))
+            self.loaded += 1
+            if self.progress:
+                self.progress(name, self.loaded, len(self.stages))
+
+        if task:
+            return task.done if self.complete else task.cont
 
 
 if __name__ == '__main__':
@@ -118,4 +170,5 @@ if __name__ == '__main__':
     base.camera.setPos(20, -20, 5)
     base.camera.lookAt(0, 0, 0)
     scene = Scene()
+    scene.load()
     base.run()
@@ -0,0 +1,138 @@
+"""Play CubicSameGame without a window to evaluate board generation and scoring.
+
+    python selfplay.py --size 4 --games 10000 --policy greedy --format csv
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from board import Board
+
+
+def random_policy(board, rng):
+    return int(rng.choice(np.flatnonzero(board.deletable_mask())))
+
+
+def first_policy(board, rng):
+    return int(np.flatnonzero(board.deletable_mask())[0])
+
+
+def greedy_policy(board, rng):
+    """Click the cell whose group is the largest; ties go to the smallest tag.
+    """
+    return int(board.group_sizes().argmax())
+
+
+POLICIES = {
+    'random': random_policy,
+    'first': first_policy,
+    'greedy': greedy_policy,
+}
+
+
+def play_game(size, policy, rng):
+    """Play one game to the end and return (total score, number of clicks).
+    """
+    board = Board.random(size, rng=rng)
+    total = moves = 0
+
+    while board.can_continue():
+        total += len(board.play(policy(board, rng)))
+        moves += 1
+
+    return total, moves
+
+
+def play_games(args):
+    size, policy_name, seed, start, stop = args
+    policy = POLICIES[policy_name]
+    results = []
+
+    for i in range(start, stop):
+        # each game has its own seed, so results do not depend on how games are split among workers.
+        rng = np.random.default_rng([seed, i])
+        results.append(play_game(size, policy, rng))
+
+    return results
+
+
+def summarize(size, policy, results, elapsed):
+    scores = np.array([score for score, _ in results])
+    moves = np.array([m for _, m in results])
+    wins = int(np.count_nonzero(scores == size ** 3))
+    values, counts = np.unique(scores, return_counts=True)
+
+    summary = {
+        'size': size,
+        'policy': policy,
+        'games': len(results),
+        'wins': wins,
+        'win_rate': wins / len(results),
+        'score_mean': float(scores.mean()),
+        'score_std': float(scores.std()),
+        'score_min': int(scores.min()),
+        'score_max': int(scores.max()),
+    }
+    for p in (10, 25, 50, 75, 90):
+        summary[f'score_p{p}'] = float(np.percentile(scores, p))
+    summary['moves_mean'] = float(moves.mean())
+    summary['elapsed'] = elapsed
+    summary['games_per_second'] = len(results) / elapsed if elapsed else float('inf')
+    summary['score_histogram'] = {int(v): int(c) for v, c in zip(values, counts)}
+
+    return summary
+
+
+def run(size, games, policy, workers, seed, chunk=100):
+    tasks = [(size, policy, seed, start, min(start + chunk, games)) for start in range(0, games, chunk)]
+    start = time.perf_counter()
+
+    if workers == 1:
+        chunks = map(play_games, tasks)
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            chunks = pool.map(play_games, tasks)
+
+    results = [r for c in chunks for r in c]
+    return summarize(size, policy, results, time.perf_counter() - start)
+
+
+def write(summary, fmt, out):
+    if fmt == 'json':
+        json.dump(summary, out, indent=2)
+        out.write('\n')
+    else:
+        row = {k: v for k, v in summary.items() if k != 'score_histogram'}
+        writer = csv.DictWriter(out, fieldnames=list(row))
+        writer.writeheader()
+        writer.writerow(row)
+
+
+def positive(value):
+    if (number := int(value)) < 1:
+        raise argparse.ArgumentTypeError(f'must be 1 or more, not {value}')
+    return number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Play CubicSameGame headless and report statistics.')
+    parser.add_argument('--size', type=positive, default=4, help='cube size')
+    parser.add_argument('--games', type=positive, default=1000, help='number of games to play')
+    parser.add_argument('--policy', choices=POLICIES, default='random', help='how to choose the sphere to click')
+    parser.add_argument('--workers', type=positive, default=multiprocessing.cpu_count(), help='worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='base seed; game i is seeded with (seed, i)')
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout)
+    args = parser.parse_args()
+
+    summary = run(args.size, args.games, args.policy, args.workers, args.seed)
+    write(summary, args.format, args.output)
+
+
+if __name__ == '__main__':
+    main()
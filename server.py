@@ -0,0 +1,311 @@
+"""Host many headless game sessions in one process, one per connection.
+
+    python server.py --port 7777                      # serve on localhost TCP
+    python server.py --unix /tmp/cubic_same_game.sock
+    python server.py --clients 32 --games 10          # load test with bots playing through the server
+
+The game connects as one of the sessions by setting `game-server localhost:7777`,
+or the path of the Unix socket, in Config.prc.
+
+Each message is a header of (kind, payload length) followed by the payload.
+A reply has the kind of its request, or ERROR with a message.
+
+    CLICK   request: tag                        reply: spheres deleted, total score, game over
+    STATE   request: -                          reply: the saved game of the session
+    SCORE   request: -                          reply: last score, total score, game over
+    RESET   request: cube size and rule,        reply: the saved game of the new board
+                     or saved game
+
+Saved games are in the format of savefile.py and carry their rule; a rule is sent as its index in RULES.
+A session plays cubes of size 1 to MAX_SIZE.
+"""
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import sys
+import time
+from enum import IntEnum
+from typing import NamedTuple
+
+import numpy as np
+
+import savefile
+from board import RULES
+from generator import generate
+from savefile import SavedGame
+
+
+HEADER = struct.Struct('<BH')
+CLICK = struct.Struct('<I')
+RESULT = struct.Struct('<HIB')   # deleted or last score, total score, game over
+SIZE = struct.Struct('<BB')      # cube size, rule
+
+# the largest cube a session plays; a new board is drawn in the event loop, stalling the other sessions.
+MAX_SIZE = 16
+
+
+class Message(IntEnum):
+
+    CLICK = 1
+    STATE = 2
+    SCORE = 3
+    RESET = 4
+    ERROR = 255
+
+
+class Result(NamedTuple):
+    score: int    # the spheres deleted by the click, or by the last one
+    total: int
+    over: bool
+
+
+def parse_address(address):
+    """Return ('unix', path) for a path, or ('tcp', host, port) for host:port.
+    """
+    if '/' in address or '\\' in address:
+        return 'unix', address
+    host, _, port = address.rpartition(':')
+    return 'tcp', host or 'localhost', int(port)
+
+
+class Session:
+    """One game played by the rules of Board, scored as the ScoreBoard does.
+    """
+
+    def __init__(self, size, rule):
+        self.reset(generate(size, rule=rule))
+
+    def reset(self, saved):
+        """Play saved by its rule.
+        """
+        if not 1 <= saved.board.size <= MAX_SIZE:
+            raise ValueError(f'cube size must be 1 to {MAX_SIZE}, not {saved.board.size}')
+        self.board = saved.board.copy()
+        self.palette = tuple(saved.palette)
+        self.total = saved.total
+        self.score = 0
+
+    @property
+    def over(self):
+        return not self.board.can_continue()
+
+    def click(self, tag):
+        if not 0 <= tag < self.board.size ** 3:
+            raise ValueError(f'no cell has the tag {tag}')
+        if tags := self.board.play(tag):
+            self.score = len(tags)
+            self.total += self.score
+        return Result(len(tags), self.total, self.over)
+
+    def saved_game(self):
+        return SavedGame(self.board.copy(), self.palette, self.total)
+
+
+class GameServer:
+    """Serve a Session to each connection, counting the sessions and the moves played.
+    """
+
+    def __init__(self, size=4, rule=RULES[0]):
+        self.size = size
+        self.rule = rule
+        self.sessions = 0   # sessions handled, including the ones still connected
+        self.active = 0
+        self.moves = 0
+        self.started = time.perf_counter()
+
+    async def start(self, address):
+        if address[0] == 'unix':
+            return await asyncio.start_unix_server(self.handle, address[1])
+        return await asyncio.start_server(self.handle, address[1], address[2])
+
+    def reply(self, session, kind, payload):
+        if kind == Message.CLICK:
+            tag, = CLICK.unpack(payload)
+            self.moves += 1
+            return RESULT.pack(*session.click(tag))
+        if kind == Message.STATE:
+            return savefile.pack(session.saved_game())
+        if kind == Message.SCORE:
+            return RESULT.pack(session.score, session.total, session.over)
+        if kind == Message.RESET:
+            if len(payload) == SIZE.size:
+                size, rule = SIZE.unpack(payload)
+                if not 1 <= size <= MAX_SIZE:
+                    raise ValueError(f'cube size must be 1 to {MAX_SIZE}, not {size}')
+                if rule >= len(RULES):
+                    raise ValueError(f'unknown rule {rule}')
+                session.reset(generate(size, rule=RULES[rule]))
+            else:
+                session.reset(savefile.unpack(payload))
+            return savefile.pack(session.saved_game())
+        raise ValueError(f'unknown message {kind}')
+
+    async def handle(self, reader, writer):
+        session = Session(self.size, self.rule)
+        self.sessions += 1
+        self.active += 1
+
+        try:
+            while True:
+                kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                payload = await reader.readexactly(length)
+                try:
+                    reply = self.reply(session, kind, payload)
+                except (ValueError, struct.error) as e:
+                    kind, reply = Message.ERROR, str(e).encode()
+                writer.write(HEADER.pack(kind, len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        return (f'{self.sessions} sessions handled, {self.active} active, {self.moves} moves, '
+                f'{self.moves / elapsed if elapsed else 0:.0f} moves/s')
+
+    async def report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(self.stats(), file=sys.stderr)
+
+
+class Client:
+    """Blocking connection to a GameServer, playing one session.
+    """
+
+    def __init__(self, address):
+        if (address := parse_address(address))[0] == 'unix':
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address[1])
+        else:
+            self.sock = socket.create_connection(address[1:])
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _recv(self, n):
+        data = b''
+        while len(data) < n:
+            if not (chunk := self.sock.recv(n - len(data))):
+                raise ConnectionError('the game server closed the connection')
+            data += chunk
+        return data
+
+    def request(self, kind, payload=b''):
+        self.sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+        kind, length = HEADER.unpack(self._recv(HEADER.size))
+        reply = self._recv(length)
+        if kind == Message.ERROR:
+            raise RuntimeError(f'game server: {reply.decode()}')
+        return reply
+
+    def click(self, tag):
+        return Result(*RESULT.unpack(self.request(Message.CLICK, CLICK.pack(tag))))
+
+    def state(self):
+        return savefile.unpack(self.request(Message.STATE))
+
+    def score(self):
+        return Result(*RESULT.unpack(self.request(Message.SCORE)))
+
+    def reset(self, saved, rule=RULES[0]):
+        """saved: SavedGame to play by its rule, or the size of a new random board played by rule
+        """
+        payload = SIZE.pack(saved, RULES.index(rule)) if isinstance(saved, int) else savefile.pack(saved)
+        return savefile.unpack(self.request(Message.RESET, payload))
+
+    def close(self):
+        self.sock.close()
+
+
+async def request(reader, writer, kind, payload=b''):
+    writer.write(HEADER.pack(kind, len(payload)) + payload)
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    reply = await reader.readexactly(length)
+    if kind == Message.ERROR:
+        raise RuntimeError(f'game server: {reply.decode()}')
+    return reply
+
+
+async def bot(address, size, rule, games, seed):
+    """Play games through the server, clicking a random deletable sphere each time,
+       and check each result against the same click on a board of its own.
+    """
+    if address[0] == 'unix':
+        reader, writer = await asyncio.open_unix_connection(address[1])
+    else:
+        reader, writer = await asyncio.open_connection(address[1], address[2])
+    rng = random.Random(seed)
+
+    for _ in range(games):
+        saved = savefile.unpack(await request(reader, writer, Message.RESET, SIZE.pack(size, RULES.index(rule))))
+        board = saved.board
+        if board.rule != rule:
+            raise RuntimeError(f'the server plays {board.rule} instead of {rule}')
+        over = not board.can_continue()
+
+        while not over:
+            tag = rng.choice(np.flatnonzero(board.deletable_mask()).tolist())
+            score, _, over = RESULT.unpack(await request(reader, writer, Message.CLICK, CLICK.pack(tag)))
+            if score != len(board.play(tag)):
+                raise RuntimeError(f'the server deleted {score} spheres for the click on {tag}')
+
+    writer.close()
+    await writer.wait_closed()
+
+
+async def load_test(server, address, clients, games):
+    listener = await server.start(address)
+    async with listener:
+        began = time.perf_counter()
+        await asyncio.gather(*(bot(address, server.size, server.rule, games, i) for i in range(clients)))
+        elapsed = time.perf_counter() - began
+        # the last sessions end once the server reads the end of their connections.
+        while server.active:
+            await asyncio.sleep(0.01)
+    print(f'{server.stats()}; {clients * games} games in {elapsed:.2f}s, {server.moves / elapsed:.0f} moves/s')
+
+
+async def serve(server, address, interval):
+    listener = await server.start(address)
+    print('serving on', ':'.join(str(part) for part in address[1:]), file=sys.stderr)
+    asyncio.create_task(server.report(interval))
+    async with listener:
+        await listener.serve_forever()
+
+
+def cube_size(value):
+    if not 1 <= (size := int(value)) <= MAX_SIZE:
+        raise argparse.ArgumentTypeError(f'must be 1 to {MAX_SIZE}, not {value}')
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve headless CubicSameGame sessions.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--size', type=cube_size, default=4, help=f'cube size of a new session, 1 to {MAX_SIZE}')
+    parser.add_argument('--rule', choices=RULES, default=RULES[0], help='how a click finds the spheres to delete')
+    parser.add_argument('--report', type=float, default=10, help='seconds between the reports of the stats')
+    parser.add_argument('--clients', type=int, help='instead of serving, play this many bots through the server')
+    parser.add_argument('--games', type=int, default=10, help='games each bot plays')
+    args = parser.parse_args()
+
+    address = ('unix', args.unix) if args.unix else ('tcp', args.host, args.port)
+    server = GameServer(args.size, args.rule)
+
+    try:
+        if args.clients:
+            asyncio.run(load_test(server, address, args.clients, args.games))
+        else:
+            asyncio.run(serve(server, address, args.report))
+    except KeyboardInterrupt:
+        print(server.stats(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
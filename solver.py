@@ -0,0 +1,256 @@
+"""Search click sequences which clear as many spheres as possible.
+
+    python solver.py --size 4 --seed 1 --time 10     # is this board winnable?
+    python solver.py --board cubic_same_game.sav     # or this saved game?
+"""
+import argparse
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import NamedTuple
+
+import numpy as np
+
+import savefile
+from board import Board, CONNECTED, MAX_COLORS, RULES
+
+
+class Solution(NamedTuple):
+    score: int       # the number of spheres the moves clear
+    moves: tuple     # the tags to click, in order
+    complete: bool   # False if the search was cut off, so a better line may exist
+
+
+class TranspositionTable:
+    """Remember the best line from board states already searched,
+       forgetting the least recently used ones when max_entries is exceeded.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        if (entry := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class Zobrist:
+
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.tables = {}
+
+    def hash(self, board):
+        if (table := self.tables.get(board.size)) is None:
+            rng = np.random.default_rng([self.seed, board.size])
+            table = rng.integers(0, 2 ** 63, size=(board.size ** 3, MAX_COLORS + 1), dtype=np.uint64)
+            self.tables[board.size] = table
+
+        flat = board.cells.reshape(-1)
+        return int(np.bitwise_xor.reduce(table[np.arange(len(flat)), flat]))
+
+
+def upper_bound(board):
+    """The spheres which can still be cleared: a color with one sphere left never can.
+    """
+    counts = np.bincount(board.cells.reshape(-1), minlength=MAX_COLORS + 1)[1:]
+    return int(counts[counts > 1].sum())
+
+
+def ordered_moves(board):
+    """Return the tags which can be clicked, largest groups first.
+       With the CONNECTED rule every sphere of a group deletes the same spheres,
+       so only one tag of each group is returned.
+    """
+    if board.rule == CONNECTED:
+        groups = sorted(board.components.groups(), key=lambda group: (-group[1], group[0]))
+        return [tag for tag, _ in groups]
+
+    sizes = board.group_sizes().reshape(-1)
+    tags = np.flatnonzero(sizes)
+    return tags[np.argsort(-sizes[tags], kind='stable')].tolist()
+
+
+def restrict_moves(board, moves, first):
+    """Return the moves which can be made by clicking one of the tags in first.
+       With the CONNECTED rule a group is kept if any of its spheres is in first,
+       and its move is replaced by the first of them.
+    """
+    if board.rule != CONNECTED:
+        allowed = set(first)
+        return [tag for tag in moves if tag in allowed]
+
+    labels = board.components.labels
+    clickable = {}
+    for tag in first:
+        clickable.setdefault(int(labels[tag]), tag)
+    return [clickable[label] for tag in moves if (label := int(labels[tag])) in clickable]
+
+
+class Solver:
+
+    def __init__(self, max_entries=200_000, seed=0, stop=None):
+        """stop: an Event which ends the search when it is set, as the time limit does
+        """
+        self.table = TranspositionTable(max_entries)
+        self.zobrist = Zobrist(seed)
+        self.stop = stop
+        self.nodes = 0
+
+    def solve(self, board, time_limit=None, node_limit=None, first=None):
+        """Search the click sequences from board depth first, trying large groups first.
+           The search stops at the time or node limit, returning the best line found so far.
+           first: the tags the first click is chosen from; any tag by default
+        """
+        self.nodes = 0
+        self.deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        score, moves, complete = self._search(board.copy(), first)
+        return Solution(score, tuple(moves), complete)
+
+    def _out_of_budget(self):
+        if self.stop is not None and self.stop.is_set():
+            return True
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            return True
+        return self.deadline is not None and time.perf_counter() >= self.deadline
+
+    def _search(self, board, first=None):
+        key = self.zobrist.hash(board)
+        if first is None and (entry := self.table.get(key)) is not None:
+            return entry[0], entry[1], True
+
+        self.nodes += 1
+        best, best_line, complete = 0, [], True
+        bound = upper_bound(board)
+        moves = ordered_moves(board)
+        if first is not None:
+            moves = restrict_moves(board, moves, first)
+
+        for tag in moves:
+            if best == bound:
+                break
+            if self._out_of_budget():
+                complete = False
+                break
+
+            child = board.copy()
+            gain = len(child.play(tag))
+            score, line, child_complete = self._search(child)
+            complete = complete and child_complete
+
+            if gain + score > best:
+                best, best_line = gain + score, [tag] + list(line)
+
+        # the best line from a restricted first click is not the best line from the board.
+        if complete and first is None:
+            self.table.put(key, (best, tuple(best_line)))
+        return best, best_line, complete
+
+
+# set in each worker process of solve_parallel to the Event which stops the searches.
+_stop = None
+
+
+def _init_worker(stop):
+    global _stop
+    _stop = stop
+
+
+def _search_child(cells, rule, deadline, max_entries):
+    time_limit = None if deadline is None else max(deadline - time.time(), 0)
+    return Solver(max_entries, stop=_stop).solve(Board(cells, rule), time_limit)
+
+
+def solve_parallel(board, time_limit=None, workers=None, max_entries=200_000):
+    """Search each first click in its own worker process and return the best Solution.
+    """
+    roots = []
+    for tag in ordered_moves(board):
+        child = board.copy()
+        roots.append((tag, len(child.play(tag)), child.cells))
+
+    if not roots:
+        return Solution(0, (), True)
+
+    bound = upper_bound(board)
+    best = Solution(0, (), False)
+    complete = True
+    # the workers share one wall clock deadline.
+    deadline = time.time() + time_limit if time_limit is not None else None
+
+    stop = multiprocessing.Event()
+    executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(stop,))
+
+    try:
+        futures = {executor.submit(_search_child, cells, board.rule, deadline, max_entries): (tag, gain)
+                   for tag, gain, cells in roots}
+
+        for future in as_completed(futures):
+            tag, gain = futures[future]
+            result = future.result()
+            complete = complete and result.complete
+
+            if gain + result.score > best.score:
+                best = Solution(gain + result.score, (tag,) + result.moves, False)
+            if best.score == bound:
+                # nothing can beat this line, so the searches still running are stopped.
+                break
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return best._replace(complete=complete or best.score == bound)
+
+
+def is_winnable(board, time_limit=None, workers=None):
+    """Return True or False, or None if the search could not decide within time_limit.
+    """
+    solution = solve_parallel(board, time_limit, workers)
+    if solution.score == board.remaining():
+        return True
+    return False if solution.complete else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check whether a CubicSameGame board is winnable.')
+    parser.add_argument('--size', type=int, default=4, help='cube size')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the board')
+    parser.add_argument('--board', help='check the board of a saved game instead of a random one')
+    parser.add_argument('--rule', choices=RULES,
+                        help='how a click finds the spheres to delete; lines, or the rule of the saved game')
+    parser.add_argument('--time', type=float, default=10, help='time limit in seconds')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='worker processes')
+    args = parser.parse_args()
+
+    if args.board:
+        board = savefile.load(args.board).board
+        board = Board(board.cells, args.rule or board.rule)
+    else:
+        board = Board.random(args.size, rng=np.random.default_rng(args.seed), rule=args.rule or RULES[0])
+    start = time.perf_counter()
+    solution = solve_parallel(board, args.time, args.workers)
+    elapsed = time.perf_counter() - start
+
+    if solution.score == board.remaining():
+        result = 'winnable'
+    else:
+        result = 'not winnable' if solution.complete else 'unknown'
+    print(f'{result}: clears {solution.score} of {board.remaining()} spheres in {elapsed:.2f}s')
+    print('moves:', ' '.join(str(t) for t in solution.moves))
+
+
+if __name__ == '__main__':
+    main()
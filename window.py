@@ -1,5 +1,5 @@
 from direct.showbase.ShowBase import ShowBase
-from panda3d.core import WindowProperties
+from panda3d.core import WindowProperties, GraphicsWindow
 
 
 class Window:
@@ -8,7 +8,9 @@ class Window:
         self.props = WindowProperties()
         self.props.setTitle(title)
         self.props.setSize(800, 600)
-        base.win.requestProperties(self.props)
+        # offscreen buffers, used by benchmarks, have no window to set up.
+        if isinstance(base.win, GraphicsWindow):
+            base.win.requestProperties(self.props)
         base.setBackgroundColor(0, 0, 0)
 
 